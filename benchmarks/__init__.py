@@ -0,0 +1 @@
+# Benchmark harness for code_reviewer; see run_benchmark.py.
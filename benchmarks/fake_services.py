@@ -0,0 +1,246 @@
+"""Local stand-ins for the Bitbucket and GigaChat APIs with tunable latency and failures."""
+
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+PAGE_SIZE = 50
+_PR_PATH = re.compile(r"^/2\.0/repositories/([^/]+)/([^/]+)/pullrequests(?:/(\d+))?(/[a-z]+)?$")
+_RANGE_DIFF_PATH = re.compile(r"^/2\.0/repositories/([^/]+)/([^/]+)/diff/(.+)$")
+_REPOSITORIES_PATH = re.compile(r"^/2\.0/repositories/([^/]+)/?$")
+
+
+class FakeBehavior:
+    """Latency and failure profile of one fake backend."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def failure(self) -> Optional[Tuple[int, Dict[str, str]]]:
+        """Sleep for the configured latency and maybe pick a failure to answer with."""
+        time.sleep(self.latency)
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.throttle_rate:
+            return 429, {"Retry-After": str(self.retry_after)}
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {}
+        return None
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeServer"
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, headers=None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status: int, data, headers=None) -> None:
+        self._send(status, json.dumps(data).encode(), "application/json", headers)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _handle(self, endpoint: str, respond) -> None:
+        self.server.count(endpoint)
+        failure = self.server.behavior.failure()
+        if failure:
+            status, headers = failure
+            self.server.count(f"{endpoint}:{status}")
+            self._json(status, {"error": "injected failure"}, headers)
+            return
+        respond()
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        if self.path == "/_stats":
+            self._json(200, self.server.stats())
+            return
+        self.server.route_get(self)
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        self.server.route_post(self)
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, behavior: FakeBehavior) -> None:
+        super().__init__(("127.0.0.1", 0), _FakeHandler)
+        self.behavior = behavior
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, endpoint: str) -> None:
+        with self._lock:
+            self._counts[endpoint] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def start(self) -> "FakeServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def route_get(self, handler: _FakeHandler) -> None:
+        handler._json(404, {"error": "not found"})
+
+    def route_post(self, handler: _FakeHandler) -> None:
+        handler._json(404, {"error": "not found"})
+
+
+class FakeBitbucket(FakeServer):
+    """Serves ``pr_count`` open PRs whose diffs have ``diff_lines`` changed lines each.
+
+    Every repository path answers with the same PRs; ``repositories`` is what the
+    workspace listing returns.
+    """
+
+    def __init__(
+        self,
+        behavior: FakeBehavior,
+        pr_count: int = 10,
+        diff_lines: int = 50,
+        repositories: Sequence[str] = ("bench/repo",),
+    ) -> None:
+        super().__init__(behavior)
+        self.pr_count = pr_count
+        self.diff_lines = diff_lines
+        self.repositories = list(repositories)
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.url}/2.0"
+
+    def route_get(self, handler: _FakeHandler) -> None:
+        parsed = urlparse(handler.path)
+        match = _PR_PATH.match(parsed.path)
+        if match and match.group(3) is None:
+            page = int(parse_qs(parsed.query).get("page", ["1"])[0])
+            handler._handle("list", lambda: handler._json(200, self._page(parsed.path, page)))
+        elif match and match.group(4) == "/diff":
+            pr_id = int(match.group(3))
+            handler._handle("diff", lambda: self._send_diff(handler, pr_id))
+        elif _RANGE_DIFF_PATH.match(parsed.path):
+            handler._handle("range_diff", lambda: self._send_diff(handler, 0))
+        elif _REPOSITORIES_PATH.match(parsed.path):
+            values = [{"full_name": name} for name in self.repositories]
+            handler._handle("repositories", lambda: handler._json(200, {"values": values}))
+        else:
+            handler._json(404, {"error": "not found"})
+
+    def route_post(self, handler: _FakeHandler) -> None:
+        match = _PR_PATH.match(urlparse(handler.path).path)
+        if match and match.group(4) == "/comments":
+            handler._read_json()
+            handler._handle("comment", lambda: handler._json(201, {"id": 1}))
+        else:
+            handler._json(404, {"error": "not found"})
+
+    def _page(self, path: str, page: int) -> Dict:
+        first = (page - 1) * PAGE_SIZE + 1
+        last = min(page * PAGE_SIZE, self.pr_count)
+        workspace, repo = _PR_PATH.match(path).group(1, 2)
+        values = [
+            {
+                "id": pr_id,
+                "title": f"Change #{pr_id}",
+                "author": {"display_name": "Bench Bot"},
+                "source": {"commit": {"hash": f"{pr_id:040x}"}},
+                "updated_on": "2024-01-01T00:00:00+00:00",
+                "links": {"html": {"href": f"https://bitbucket.test/{workspace}/{repo}/{pr_id}"}},
+            }
+            for pr_id in range(first, last + 1)
+        ]
+        data: Dict = {"values": values}
+        if last < self.pr_count:
+            data["next"] = f"{self.url}{path}?page={page + 1}"
+        return data
+
+    def _send_diff(self, handler: _FakeHandler, pr_id: int) -> None:
+        # Every PR gets different content so the review cache cannot short-circuit it.
+        lines = [
+            f"diff --git a/src/module_{pr_id}.py b/src/module_{pr_id}.py",
+            f"--- a/src/module_{pr_id}.py",
+            f"+++ b/src/module_{pr_id}.py",
+            f"@@ -1,{self.diff_lines} +1,{self.diff_lines} @@",
+        ]
+        for index in range(self.diff_lines):
+            lines.append(f"-value_{pr_id}_{index} = compute({index})")
+            lines.append(f"+value_{pr_id}_{index} = compute({index}, cached=True)")
+        handler._send(200, ("\n".join(lines) + "\n").encode(), "text/plain")
+
+
+class FakeGigaChat(FakeServer):
+    """Answers chat completions with a canned review, as JSON or server-sent events."""
+
+    REVIEW = "Критичных проблем нет. Рекомендация: добавить тесты."
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.url}/api/v1"
+
+    def route_post(self, handler: _FakeHandler) -> None:
+        if urlparse(handler.path).path != "/api/v1/chat/completions":
+            handler._json(404, {"error": "not found"})
+            return
+        payload = handler._read_json()
+        prompt_chars = sum(len(message["content"]) for message in payload["messages"])
+        usage = {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": len(self.REVIEW) // 4,
+            "total_tokens": (prompt_chars + len(self.REVIEW)) // 4,
+        }
+        if payload.get("stream"):
+            handler._handle("chat", lambda: self._send_stream(handler, usage))
+            return
+        body = {
+            "choices": [
+                {"message": {"role": "assistant", "content": self.REVIEW}, "finish_reason": "stop"}
+            ],
+            "usage": usage,
+        }
+        handler._handle("chat", lambda: handler._json(200, body))
+
+    def _send_stream(self, handler: _FakeHandler, usage: Dict) -> None:
+        events = [{"choices": [{"delta": {"content": word + " "}}]} for word in self.REVIEW.split()]
+        events.append({"choices": [{"delta": {}, "finish_reason": "stop"}], "usage": usage})
+        body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+        handler._send(200, body.encode(), "text/event-stream")
@@ -0,0 +1,200 @@
+"""Drive the real PullRequestAgent against local fake backends and report throughput.
+
+Example:
+    python benchmarks/run_benchmark.py --prs 200 --gigachat-latency 0.5 --output bench.json
+"""
+
+import argparse
+import importlib.metadata
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from typing import Dict, List, Optional
+
+if __package__ in (None, ""):
+    # Allow running as a script from a source checkout.
+    sys.path[:0] = [
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"),
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    ]
+
+from benchmarks.fake_services import (  # noqa: E402
+    FakeBehavior,
+    FakeBitbucket,
+    FakeGigaChat,
+)
+from code_reviewer.agent import PullRequestAgent  # noqa: E402
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--label", default="", help="Free-form name stored with the results.")
+    parser.add_argument("--prs", type=int, default=100, help="Number of open PRs to serve.")
+    parser.add_argument("--diff-lines", type=int, default=200, help="Changed lines per PR diff.")
+    parser.add_argument("--bitbucket-latency", type=float, default=0.05)
+    parser.add_argument("--gigachat-latency", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of HTTP 500s.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of HTTP 429s.")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="Retry-After of 429s.")
+    parser.add_argument("--bitbucket-concurrency", type=int, default=4)
+    parser.add_argument("--gigachat-concurrency", type=int, default=2)
+    parser.add_argument("--bitbucket-rps", type=float, default=50.0)
+    parser.add_argument("--gigachat-rps", type=float, default=20.0)
+    parser.add_argument("--gigachat-stream", action="store_true")
+    parser.add_argument("--output", default=None, help="Write the JSON results to this file.")
+    return parser.parse_args(argv)
+
+
+def run_benchmark(args: argparse.Namespace, in_process: bool = False) -> Dict:
+    """Run one sweep against fresh fake backends and return the measurements.
+
+    The fakes run in a child process by default so peak RSS reflects the agent alone.
+    """
+    fakes = _InProcessFakes(args) if in_process else _SubprocessFakes(args)
+    bitbucket_url, gigachat_url = fakes.start()
+    try:
+        agent = PullRequestAgent(
+            bitbucket_repo="bench/repo",
+            bitbucket_username="bench",
+            bitbucket_token="bench",
+            gigachat_token="bench",
+            bitbucket_api_url=bitbucket_url,
+            gigachat_url=gigachat_url,
+            bitbucket_concurrency=args.bitbucket_concurrency,
+            gigachat_concurrency=args.gigachat_concurrency,
+            bitbucket_rps=args.bitbucket_rps,
+            gigachat_rps=args.gigachat_rps,
+            gigachat_stream=args.gigachat_stream,
+            cache_size=0,
+        )
+        started = time.monotonic()
+        results = agent.review_open_pull_requests()
+        duration = time.monotonic() - started
+    finally:
+        requests_served = fakes.stop()
+
+    return {
+        "label": args.label,
+        "version": _package_version(),
+        "python": platform.python_version(),
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("label", "output")
+        },
+        "prs_reviewed": len(results),
+        "prs_failed": agent.failures,
+        "duration_seconds": round(duration, 3),
+        "prs_per_minute": round(len(results) / duration * 60, 2) if duration else 0.0,
+        "latency_seconds": _latency(agent),
+        # ru_maxrss is KiB on Linux and bytes on macOS.
+        "peak_rss_kib": _peak_rss_kib(),
+        "requests": requests_served,
+        "retries": {
+            "bitbucket": agent.bitbucket.rate_limiter.retries,
+            "gigachat": agent.gigachat.rate_limiter.retries,
+        },
+    }
+
+
+def _latency(agent: PullRequestAgent) -> Dict[str, float]:
+    """Per-PR review latency percentiles from the agent's own histogram."""
+    labels = {"repo": agent.repo_slug}
+    series = [
+        entry
+        for entry in agent.metrics.summary()["histograms"].get("pr_review_seconds", [])
+        if entry["labels"] == labels
+    ]
+    return {
+        "p50": round(agent.metrics.quantile("pr_review_seconds", 0.50, **labels), 4),
+        "p95": round(agent.metrics.quantile("pr_review_seconds", 0.95, **labels), 4),
+        "p99": round(agent.metrics.quantile("pr_review_seconds", 0.99, **labels), 4),
+        "max": round(series[0]["max"], 4) if series else 0.0,
+    }
+
+
+def _package_version() -> str:
+    try:
+        return importlib.metadata.version("code-reviewer")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def _peak_rss_kib() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _build_fakes(args: argparse.Namespace):
+    bitbucket = FakeBitbucket(
+        FakeBehavior(args.bitbucket_latency, args.error_rate, args.throttle_rate, args.retry_after),
+        pr_count=args.prs,
+        diff_lines=args.diff_lines,
+    )
+    gigachat = FakeGigaChat(
+        FakeBehavior(
+            args.gigachat_latency, args.error_rate, args.throttle_rate, args.retry_after, seed=1
+        )
+    )
+    return bitbucket, gigachat
+
+
+class _InProcessFakes:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.servers = ()
+
+    def start(self):
+        self.servers = tuple(server.start() for server in _build_fakes(self.args))
+        return self.servers[0].api_url, self.servers[1].api_url
+
+    def stop(self) -> Dict[str, Dict[str, int]]:
+        stats = {"bitbucket": self.servers[0].stats(), "gigachat": self.servers[1].stats()}
+        for server in self.servers:
+            server.stop()
+        return stats
+
+
+class _SubprocessFakes:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve_fakes, args=(args, child_conn), daemon=True
+        )
+
+    def start(self):
+        self.process.start()
+        return self.conn.recv()
+
+    def stop(self) -> Dict[str, Dict[str, int]]:
+        self.conn.send("stop")
+        stats = self.conn.recv()
+        self.process.join()
+        return stats
+
+
+def _serve_fakes(args: argparse.Namespace, conn) -> None:
+    bitbucket, gigachat = (server.start() for server in _build_fakes(args))
+    conn.send((bitbucket.api_url, gigachat.api_url))
+    conn.recv()
+    conn.send({"bitbucket": bitbucket.stats(), "gigachat": gigachat.stats()})
+    bitbucket.stop()
+    gigachat.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
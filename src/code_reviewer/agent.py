@@ -1,10 +1,46 @@
 import logging
 import os
-from typing import Dict, List
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
 from urllib.parse import urlparse
 
+import requests
+
+from .batching import ReviewBatcher, parse_batch_reviews
 from .bitbucket_client import BitbucketClient
-from .gigachat_client import GigaChatClient
+from .cache import ReviewCache
+from .chunking import CHARS_PER_TOKEN, estimate_tokens, split_diff
+from .compaction import CompactionStats, compact_file
+from .diff_parser import DiffFile, parse_unified_diff, render_diff
+from .gigachat_client import ChatCompletion, GigaChatClient
+from .lease import Leases
+from .metrics import Metrics
+from .ratelimit import AdaptiveRateLimiter
+from .state import ReviewState
+from .triage import DiffStat, PriorityRule, priority
+
+# Margin for clock skew between this host and Bitbucket when moving the listing cursor.
+LISTING_OVERLAP = timedelta(minutes=5)
+SYSTEM_PROMPT = "Act as a senior backend engineer. Provide concise, actionable code review."
+REVIEW_INSTRUCTIONS = (
+    "Сделай краткий code review этого диффа. Сначала перечисли критичные проблемы, "
+    "затем рекомендации и улучшения. Ответ держи сжато и на русском языке."
+)
+REDUCE_INSTRUCTIONS = (
+    "Выше частичные ревью разных частей одного Pull Request. Объедини их в одно краткое "
+    "ревью: убери повторы, сначала перечисли критичные проблемы, затем рекомендации. "
+    "Ответ держи сжато и на русском языке."
+)
+BATCH_INSTRUCTIONS = (
+    "Выше несколько небольших независимых Pull Request. Сделай краткий code review каждого "
+    "отдельно: сначала критичные проблемы, затем рекомендации, на русском языке. Верни только "
+    "JSON-объект без пояснений, где ключ — номер PR строкой, а значение — текст ревью, например "
+    '{"12": "...", "15": "..."}.'
+)
+TRUNCATED_NOTE = "\n\n_(ответ модели обрезан по лимиту времени или длины)_"
 
 
 def parse_bitbucket_repo_slug(value: str) -> str:
@@ -42,87 +78,651 @@ class PullRequestAgent:
         gigachat_url: str = "https://gigachat.devices.sberbank.ru/api/v1",
         gigachat_model: str = "GigaChat",
         max_diff_chars: int = 12000,
+        bitbucket_concurrency: int = 4,
+        gigachat_concurrency: int = 2,
+        state_path: Optional[str] = None,
+        cache_size: int = 1024,
+        cache_path: Optional[str] = None,
+        chunked_review: bool = False,
+        max_chunks: int = 8,
+        max_tokens_per_pr: int = 32000,
+        diff_include: Optional[Sequence[str]] = None,
+        diff_exclude: Optional[Sequence[str]] = None,
+        bitbucket_rps: float = 10.0,
+        gigachat_rps: float = 2.0,
+        max_retries: int = 5,
+        gigachat_stream: bool = False,
+        max_output_tokens: Optional[int] = None,
+        review_deadline: float = 60.0,
+        compact_diff: bool = True,
+        diff_context: Optional[int] = 1,
+        batch_pr_chars: int = 0,
+        batch_size: int = 10,
+        lease_dir: Optional[str] = None,
+        triage: bool = False,
+        priority_rules: Optional[Sequence[str]] = None,
+        max_pr_lines: Optional[int] = None,
+        oversize_action: str = "defer",
+        metrics: Optional[Metrics] = None,
+        bitbucket_session: Optional[requests.Session] = None,
+        bitbucket_rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        gigachat: Optional[GigaChatClient] = None,
     ) -> None:
+        # metrics, bitbucket_session, bitbucket_rate_limiter and gigachat let agents of several
+        # repositories share one registry and one set of connections and limits.
+        if bitbucket_concurrency < 1 or gigachat_concurrency < 1:
+            raise ValueError("Concurrency limits must be positive")
+        if oversize_action not in ("defer", "skip"):
+            raise ValueError("oversize_action must be 'defer' or 'skip'")
+
         repo_slug = parse_bitbucket_repo_slug(bitbucket_repo)
+        self.state = ReviewState(state_path)
+        self.metrics = metrics or Metrics()
         self.bitbucket = BitbucketClient(
             repo_slug=repo_slug,
             username=bitbucket_username,
             token=bitbucket_token,
             base_url=bitbucket_api_url,
+            # One extra connection for the listing, which runs outside the worker slots.
+            pool_size=bitbucket_concurrency + 1,
+            rate_limiter=bitbucket_rate_limiter
+            or AdaptiveRateLimiter(
+                "Bitbucket", rate=bitbucket_rps, max_retries=max_retries, metrics=self.metrics
+            ),
+            etag_cache=self.state.etags(repo_slug),
+            metrics=self.metrics,
+            session=bitbucket_session,
         )
-        self.gigachat = GigaChatClient(
+        self.gigachat = gigachat or GigaChatClient(
             token=gigachat_token,
             base_url=gigachat_url,
             model=gigachat_model,
+            pool_size=gigachat_concurrency,
+            rate_limiter=AdaptiveRateLimiter(
+                "GigaChat", rate=gigachat_rps, max_retries=max_retries, metrics=self.metrics
+            ),
+            stream=gigachat_stream,
+            max_tokens=max_output_tokens,
+            deadline=review_deadline,
+            metrics=self.metrics,
         )
         self.max_diff_chars = max_diff_chars
+        self.chunked_review = chunked_review
+        self.max_chunks = max_chunks
+        self.max_tokens_per_pr = max_tokens_per_pr
+        self.diff_include = list(diff_include or [])
+        self.diff_exclude = list(diff_exclude or [])
+        self.compact_diff = compact_diff
+        # One line of context is enough for review; None keeps the server default of 3.
+        self.diff_context = diff_context
+        # Diffs up to batch_pr_chars share one model request, within the usual prompt size.
+        self.batch_pr_chars = batch_pr_chars
+        self._batcher = ReviewBatcher(max_chars=max_diff_chars, max_size=batch_size)
+        # Shared with other processes or hosts so two workers never review the same PR at once.
+        self.leases = Leases(lease_dir) if lease_dir else None
+        # Diffstat triage: review small and urgent PRs first, hold back or drop huge ones.
+        self.triage = triage
+        self.priority_rules = [PriorityRule.parse(rule) for rule in priority_rules or []]
+        self.max_pr_lines = max_pr_lines
+        self.oversize_action = oversize_action
         self.repo_slug = repo_slug
+        self.bitbucket_concurrency = bitbucket_concurrency
+        self.gigachat_concurrency = gigachat_concurrency
+        self.cache = ReviewCache(max_entries=cache_size, path=cache_path)
+        # Each backend gets its own limit so slow model calls never starve Bitbucket I/O.
+        self._bitbucket_slots = threading.BoundedSemaphore(bitbucket_concurrency)
+        self._gigachat_slots = threading.BoundedSemaphore(gigachat_concurrency)
+        self.failures = 0
+        # PRs skipped because another worker held them; like failures, they keep the cursor.
+        self.leased = 0
+        self._failures_lock = threading.Lock()
 
     def review_open_pull_requests(self) -> List[Dict[str, str]]:
-        prs = self.bitbucket.list_open_pull_requests()
-        if not prs:
-            logging.info("No open pull requests in %s", self.repo_slug)
-            return []
+        """Review all open PRs and return the results in listing order."""
+        return [result for _, result in sorted(self._sweep(), key=lambda item: item[0])]
+
+    def iter_reviews(self) -> Iterator[Dict[str, str]]:
+        """Yield the result of every reviewed open PR as soon as its comment is posted.
+
+        Results come in completion order and are not kept, so memory does not grow with
+        the number of PRs. Closing the generator early cancels PRs that have not started
+        and leaves the listing cursor where it was.
+        """
+        for _, result in self._sweep():
+            yield result
+
+    def _sweep(self) -> Iterator[Tuple[int, Dict[str, str]]]:
+        """Yield ``(listing position, result)`` pairs of one pass over the open PRs."""
+        # Only PRs updated since the last clean sweep; older ones were reviewed already.
+        cursor = self.state.listing_cursor(self.repo_slug)
+        # PRs pushed while the sweep runs must be listed next time, so the next cursor is the
+        # start of this listing. It is rounded down to the hour: the q= filter then stays the
+        # same across sweeps within that hour, so their listing pages can come back as 304s.
+        # Re-listed PRs whose head commit was reviewed are skipped cheaply.
+        listing_started = (datetime.now(timezone.utc) - LISTING_OVERLAP).replace(
+            minute=0, second=0, microsecond=0
+        )
+        unfinished_before = self.failures + self.leased
+
+        # Enough workers to keep both stages saturated; the semaphores enforce the limits.
+        workers = self.bitbucket_concurrency + self.gigachat_concurrency
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="review")
+        pending: Set[Future] = set()
+        order: Dict[int, int] = {}
+        listed: List[Dict] = []
+        finished = False
+
+        def submit(pr: Dict) -> None:
+            order.setdefault(pr.get("id"), len(order))
+            pending.add(pool.submit(self._review_listed, pr))
 
-        results: List[Dict[str, str]] = []
-        for pr in prs:
+        def position(result: Dict[str, str]) -> int:
+            return order.get(result["id"], len(order))
+
+        try:
+            # Without triage, reviews of the first page start while later pages are listed.
+            pages = self.bitbucket.iter_open_pull_request_pages(updated_after=cursor)
+            while True:
+                with self.metrics.timer("stage_seconds", stage="list", repo=self.repo_slug):
+                    page = next(pages, None)
+                if page is None:
+                    break
+                for pr in page:
+                    if self.triage:
+                        listed.append(pr)
+                    else:
+                        submit(pr)
+                for result in _completed(pending, wait=False):
+                    yield position(result), result
+            if self.triage:
+                # The pool runs tasks in submission order, so this is the review order.
+                for pr in self._schedule(listed, pool):
+                    submit(pr)
+            for result in _completed(pending, wait=True):
+                yield position(result), result
+            # Whatever is left in the last, partly filled batch.
+            for result in self._review_batch(self._batcher.drain()):
+                yield position(result), result
+            finished = True
+        finally:
+            pool.shutdown(wait=True, cancel_futures=not finished)
+            if not finished:
+                # Held-back small PRs will not be reviewed now; let other workers take them.
+                for held in self._batcher.drain():
+                    self._release(held.pr["id"])
+            self.cache.save()
+
+        # A failed PR, or one leased by a worker that may crash, must show up in the next
+        # listing, so the cursor only moves when every listed PR was dealt with here.
+        clean = self.failures + self.leased == unfinished_before
+        self.state.record_listing(
+            self.repo_slug,
+            self.bitbucket.requested_etags(),
+            listing_started.isoformat() if clean else None,
+        )
+        if not order and not listed:
+            logging.info("No open pull requests updated in %s", self.repo_slug)
+
+    def _schedule(self, prs: List[Dict], pool: ThreadPoolExecutor) -> List[Dict]:
+        """Order PRs by size, age and priority rules; drop those not worth downloading."""
+        with self._stage("triage"):
+            stats = list(pool.map(self._diffstat, prs))
+        ready: List[Tuple[Dict, Optional[DiffStat]]] = []
+        deferred: List[Tuple[Dict, Optional[DiffStat]]] = []
+        for pr, stat in zip(prs, stats):
             pr_id = pr.get("id")
-            if pr_id is None:
-                logging.warning("Skip PR without id: %s", pr)
-                continue
-            try:
-                # Fetch diff -> ask GigaChat -> post comment for each PR.
-                diff = self.bitbucket.pull_request_diff(pr_id)
-                prompt = self._build_prompt(pr, diff)
-                messages = [
-                    {
-                        "role": "system",
-                        "content": (
-                            "Act as a senior backend engineer. Provide concise, actionable code review."
-                        ),
-                    },
-                    {"role": "user", "content": prompt},
-                ]
-                logging.info("Sending PR #%s to GigaChat for review", pr_id)
-                review = self.gigachat.chat(messages)
+            if stat is not None and not stat.paths:
+                logging.info("Skip PR #%s: no reviewable paths in diffstat", pr_id)
+                head = _source_commit(pr)
+                if head:
+                    self.state.record(self.repo_slug, pr_id, head)
+                self._count_outcome("skipped")
+            elif self.max_pr_lines and stat and stat.changed_lines > self.max_pr_lines:
+                if self.oversize_action == "skip":
+                    logging.info(
+                        "Skip PR #%s: %s changed lines exceed the limit of %s",
+                        pr_id,
+                        stat.changed_lines,
+                        self.max_pr_lines,
+                    )
+                    self._count_outcome("too_large")
+                else:
+                    deferred.append((pr, stat))
+            else:
+                ready.append((pr, stat))
+
+        now = datetime.now(timezone.utc)
+
+        def score(item: Tuple[Dict, Optional[DiffStat]]) -> float:
+            return priority(item[0], item[1], self.priority_rules, now)
+
+        scheduled = sorted(ready, key=score) + sorted(deferred, key=score)
+        logging.info(
+            "Triage of %s PRs: %s scheduled, %s deferred as too large",
+            len(prs),
+            len(ready),
+            len(deferred),
+        )
+        return [pr for pr, _ in scheduled]
+
+    def _diffstat(self, pr: Dict) -> Optional[DiffStat]:
+        """Fetch the size of the changes to review; None when unknown or not needed."""
+        pr_id = pr.get("id")
+        head = _source_commit(pr)
+        last_reviewed = self.state.last_commit(self.repo_slug, pr_id) if pr_id else None
+        if pr_id is None or (head and last_reviewed and _same_commit(head, last_reviewed)):
+            return None
+        try:
+            with self._bitbucket_slots:
+                if head and last_reviewed:
+                    entries = self.bitbucket.commit_range_diffstat(last_reviewed, head)
+                else:
+                    entries = self.bitbucket.pull_request_diffstat(pr_id)
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.warning("Diffstat of PR #%s failed, scheduling it by age only: %s", pr_id, exc)
+            return None
+        return DiffStat.from_entries(entries, self.diff_include, self.diff_exclude)
+
+    def review_pull_request(self, pr: Dict) -> Optional[Dict[str, str]]:
+        """Review one PR payload; returns None when it was skipped or failed."""
+        pending = self._prepare(pr)
+        if pending is None:
+            return None
+        return self._publish(pending)
+
+    def _review_listed(self, pr: Dict) -> List[Dict[str, str]]:
+        """Review a PR from the sweep, holding small ones back to share a model request."""
+        pending = self._prepare(pr)
+        if pending is None:
+            return []
+        if len(pending.diff) > self.batch_pr_chars:
+            result = self._publish(pending)
+            return [result] if result else []
+        # A cached review is free; batching it would only spend tokens again.
+        cached = self.cache.get(self._cache_key(pending.diff))
+        if cached is not None:
+            result = self._publish(pending, cached)
+            return [result] if result else []
+        return self._review_batch(self._batcher.add(pending, len(pending.diff)) or [])
+
+    def _prepare(self, pr: Dict) -> Optional["_PendingReview"]:
+        """Fetch the diff of a PR unless it has nothing new to review."""
+        pr_id = pr.get("id")
+        if pr_id is None:
+            logging.warning("Skip PR without id: %s", pr)
+            return None
+        head = _source_commit(pr)
+        last_reviewed = self.state.last_commit(self.repo_slug, pr_id)
+        if head and last_reviewed and _same_commit(head, last_reviewed):
+            logging.info("Skip PR #%s: commit %s already reviewed", pr_id, head[:12])
+            self._count_outcome("skipped")
+            return None
+        started = time.monotonic()
+        if self.leases and not self.leases.acquire(self._lease_key(pr_id)):
+            logging.info("Skip PR #%s: another worker is reviewing it", pr_id)
+            with self._failures_lock:
+                self.leased += 1
+            self._count_outcome("leased")
+            return None
+        try:
+            # Fetch diff -> ask GigaChat -> post comment; every stage waits for its own slot.
+            with self._bitbucket_slots, self._stage("diff"):
+                files, since = self._fetch_diff(pr_id, last_reviewed, head)
+        except Exception as exc:  # pylint: disable=broad-except
+            self._release(pr_id)
+            self._fail(pr_id, exc)
+            return None
+        if not files:
+            logging.info("Skip PR #%s: no reviewable changes after path filters", pr_id)
+            if head:
+                self.state.record(self.repo_slug, pr_id, head)
+            self._release(pr_id)
+            self._count_outcome("skipped")
+            return None
+        return _PendingReview(pr, render_diff(files), since, head, started)
+
+    def _publish(
+        self, pending: "_PendingReview", review: Optional[str] = None
+    ) -> Optional[Dict[str, str]]:
+        """Review the PR unless ``review`` is given, then comment and remember the commit."""
+        pr = pending.pr
+        pr_id = pr["id"]
+        try:
+            if review is None:
+                with self._stage("review"):
+                    review = self._review_diff(pr, pending.diff, pending.since)
+            with self._bitbucket_slots, self._stage("comment"):
                 self.bitbucket.comment_pull_request(pr_id, review)
-                results.append(
-                    {
-                        "id": pr_id,
-                        "title": pr.get("title", ""),
-                        "url": pr.get("links", {}).get("html", {}).get("href", ""),
-                        "review": review,
-                    }
-                )
-                logging.info("Posted review comment to PR #%s", pr_id)
+            logging.info("Posted review comment to PR #%s", pr_id)
+            if pending.head:
+                self.state.record(self.repo_slug, pr_id, pending.head)
+        except Exception as exc:  # pylint: disable=broad-except
+            self._fail(pr_id, exc)
+            return None
+        finally:
+            self._release(pr_id)
+        # From fetching the diff to the posted comment, including time held in a batch.
+        self.metrics.observe(
+            "pr_review_seconds", time.monotonic() - pending.started, repo=self.repo_slug
+        )
+        self._count_outcome("reviewed")
+        return {
+            "id": pr_id,
+            "title": pr.get("title", ""),
+            "url": pr.get("links", {}).get("html", {}).get("href", ""),
+            "review": review,
+        }
+
+    def _lease_key(self, pr_id: int) -> str:
+        return f"{self.repo_slug}#{pr_id}"
+
+    def _release(self, pr_id: int) -> None:
+        if self.leases:
+            self.leases.release(self._lease_key(pr_id))
+
+    def _fail(self, pr_id: int, exc: Exception) -> None:
+        logging.error("Failed to review PR %s: %s", pr_id, exc)
+        with self._failures_lock:
+            self.failures += 1
+        self._count_outcome("failed")
+
+    def _review_batch(self, batch: List["_PendingReview"]) -> List[Dict[str, str]]:
+        """Review several small PRs with one model request, one by one if that fails."""
+        reviews: Dict[int, str] = {}
+        if len(batch) > 1:
+            pr_ids = [pending.pr["id"] for pending in batch]
+            try:
+                with self._stage("review"):
+                    prompt = self._build_batch_prompt(batch)
+                    with self._gigachat_slots:
+                        logging.info("Sending PRs %s to GigaChat in one batch", pr_ids)
+                        completion = self._ask(f"batch {pr_ids}", _messages(prompt))
+                if completion.truncated:
+                    raise ValueError("answer was cut off")
+                reviews = parse_batch_reviews(completion.content, pr_ids)
             except Exception as exc:  # pylint: disable=broad-except
-                logging.error("Failed to review PR %s: %s", pr_id, exc)
+                logging.warning(
+                    "Batch review of PRs %s failed, reviewing them one by one: %s", pr_ids, exc
+                )
+            answered, fallback = len(reviews), len(batch) - len(reviews)
+            self.metrics.inc("batched_prs_total", answered, outcome="answered", repo=self.repo_slug)
+            self.metrics.inc("batched_prs_total", fallback, outcome="fallback", repo=self.repo_slug)
+
+        results = []
+        for pending in batch:
+            review = reviews.get(pending.pr["id"])
+            if review is not None:
+                self.cache.put(self._cache_key(pending.diff), review)
+            result = self._publish(pending, review)
+            if result:
+                results.append(result)
         return results
 
-    def _build_prompt(self, pr: Dict, diff: str) -> str:
-        author = pr.get("author", {}) or {}
-        author_name = author.get("display_name") or author.get("nickname") or "unknown"
-        header = (
+    def _cache_key(self, diff: str, chunked: bool = False) -> str:
+        template = SYSTEM_PROMPT + REVIEW_INSTRUCTIONS + (REDUCE_INSTRUCTIONS if chunked else "")
+        return ReviewCache.key(self.gigachat.model, template, diff)
+
+    def _review_diff(self, pr: Dict, diff: str, since: Optional[str]) -> str:
+        chunked = self.chunked_review and len(diff) > self.max_diff_chars
+        # Identical hunks (rebases, cherry-picks) map to one cache entry across PRs.
+        cache_key = self._cache_key(diff, chunked)
+        review = self.cache.get(cache_key)
+        if review is not None:
+            logging.info("Reuse cached review for PR #%s", pr.get("id"))
+            return review
+
+        if chunked:
+            review, truncated = self._map_reduce_review(pr, diff, since)
+            if not truncated:
+                self.cache.put(cache_key, review)
+            return review
+
+        messages = _messages(self._build_prompt(pr, diff, since_commit=since))
+        with self._gigachat_slots:
+            # Another worker may have reviewed the same hunks while this one waited.
+            cached = self.cache.recheck(cache_key)
+            if cached is not None:
+                return cached
+            logging.info("Sending PR #%s to GigaChat for review", pr.get("id"))
+            completion = self._ask(f"PR #{pr.get('id')}", messages)
+        # A review cut by the deadline is worth posting but not worth reusing.
+        if not completion.truncated:
+            self.cache.put(cache_key, completion.content)
+        return completion.content
+
+    def _map_reduce_review(self, pr: Dict, diff: str, since: Optional[str]) -> Tuple[str, bool]:
+        """Review a large diff piece by piece in parallel, then merge the partial reviews.
+
+        Returns the review and whether any of the model answers behind it was cut off.
+        """
+        chunks = split_diff(diff, self.max_diff_chars)
+        selected: List[str] = []
+        spent = 0
+        for chunk in chunks[: self.max_chunks]:
+            cost = estimate_tokens(chunk)
+            # Always review at least one piece, then stop at the per-PR token budget.
+            if selected and spent + cost > self.max_tokens_per_pr:
+                break
+            selected.append(chunk)
+            spent += cost
+        omitted = len(chunks) - len(selected)
+        logging.info(
+            "Reviewing PR #%s in %s of %s chunks (~%s prompt tokens)",
+            pr.get("id"),
+            len(selected),
+            len(chunks),
+            spent,
+        )
+
+        def review_chunk(index: int) -> ChatCompletion:
+            part = (index + 1, len(selected))
+            messages = _messages(self._build_prompt(pr, selected[index], since, part=part))
+            with self._gigachat_slots:
+                return self._ask(f"PR #{pr.get('id')}", messages)
+
+        workers = min(len(selected), self.gigachat_concurrency)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk") as pool:
+            completions = list(pool.map(review_chunk, range(len(selected))))
+        partials = [completion.content for completion in completions]
+        truncated = any(completion.truncated for completion in completions)
+        if len(partials) == 1 and not omitted:
+            return partials[0], truncated
+
+        sections = [
+            f"Part {index} of {len(partials)}:\n{partial}"
+            for index, partial in enumerate(partials, start=1)
+        ]
+        if omitted:
+            sections.append(f"{omitted} more parts of the diff were not reviewed (budget limit).")
+        prompt = (
             f"Repository: {self.repo_slug}\n"
-            f"Pull Request: #{pr.get('id')} {pr.get('title')}\n"
-            f"Author: {author_name}\n"
-            f"URL: {pr.get('links', {}).get('html', {}).get('href', '')}\n"
-            f"Description:\n{pr.get('description') or 'No description provided.'}\n"
+            f"Pull Request: #{pr.get('id')} {pr.get('title')}\n\n"
+            + "\n\n".join(sections)
+            + "\n\n"
+            + REDUCE_INSTRUCTIONS
         )
+        with self._gigachat_slots:
+            merged = self._ask(f"PR #{pr.get('id')}", _messages(prompt))
+        return merged.content, truncated or merged.truncated
+
+    def _stage(self, stage: str):
+        return self.metrics.timer("stage_seconds", stage=stage, repo=self.repo_slug)
+
+    def _count_outcome(self, outcome: str) -> None:
+        self.metrics.inc("pull_requests_total", repo=self.repo_slug, outcome=outcome)
 
+    def _ask(self, subject: str, messages: List[Dict[str, str]]) -> ChatCompletion:
+        completion = self.gigachat.complete(messages, repo=self.repo_slug)
+        for kind in ("prompt", "completion"):
+            tokens = completion.usage.get(f"{kind}_tokens")
+            if tokens:
+                self.metrics.inc("tokens_total", tokens, kind=kind, repo=self.repo_slug)
+        if completion.time_to_first_token is not None:
+            self.metrics.observe(
+                "time_to_first_token_seconds", completion.time_to_first_token, repo=self.repo_slug
+            )
+            logging.info(
+                "GigaChat answered %s: first token after %.1fs, done after %.1fs",
+                subject,
+                completion.time_to_first_token,
+                completion.elapsed,
+            )
+        if completion.truncated:
+            logging.warning("GigaChat answer for %s was cut off", subject)
+            completion.content += TRUNCATED_NOTE
+        return completion
+
+    def _fetch_diff(
+        self, pr_id: int, last_reviewed: Optional[str], head: Optional[str]
+    ) -> Tuple[List[DiffFile], Optional[str]]:
+        """Return the files to review and the commit they start from (None for the full PR)."""
+        if last_reviewed and head:
+            try:
+                lines = self.bitbucket.iter_commit_range_diff(
+                    last_reviewed, head, context=self.diff_context
+                )
+                return self._read_diff(pr_id, lines), last_reviewed
+            except Exception as exc:  # pylint: disable=broad-except
+                # Force-pushes can drop the old commit; review the whole PR again then.
+                logging.warning(
+                    "Incremental diff for PR #%s failed, using full diff: %s", pr_id, exc
+                )
+        lines = self.bitbucket.iter_pull_request_diff(pr_id, context=self.diff_context)
+        return self._read_diff(pr_id, lines), None
+
+    def _read_diff(self, pr_id: int, lines: Iterable[str]) -> List[DiffFile]:
+        """Parse a streamed diff, stopping the download once the review cannot use more."""
+        budget = self.max_diff_chars
+        if self.chunked_review:
+            budget = max(
+                budget,
+                min(
+                    self.max_chunks * self.max_diff_chars, self.max_tokens_per_pr * CHARS_PER_TOKEN
+                ),
+            )
+        stream = parse_unified_diff(
+            lines, include=self.diff_include, exclude=self.diff_exclude, max_file_chars=budget
+        )
+        files: List[DiffFile] = []
+        size = 0
+        stats = CompactionStats()
+        try:
+            for diff_file in stream:
+                # Compacting before the budget check lets more real code fit into the prompt.
+                if self.compact_diff:
+                    compact_file(diff_file, stats)
+                files.append(diff_file)
+                size += diff_file.size
+                if size > budget:
+                    break
+        finally:
+            stream.close()
+        if self.compact_diff and stats.chars_before:
+            logging.info(
+                "Compacted diff of PR #%s from %s to %s chars (-%.0f%%)",
+                pr_id,
+                stats.chars_before,
+                stats.chars_after,
+                stats.saved_ratio * 100,
+            )
+            self.metrics.inc(
+                "diff_chars_total", stats.chars_before, stage="raw", repo=self.repo_slug
+            )
+            self.metrics.inc(
+                "diff_chars_total", stats.chars_after, stage="compacted", repo=self.repo_slug
+            )
+        return files
+
+    def _build_batch_prompt(self, batch: List["_PendingReview"]) -> str:
+        sections = [
+            _describe_pr(pending.pr, pending.since) + "Diff:\n" + pending.diff for pending in batch
+        ]
+        return (
+            f"Repository: {self.repo_slug}\n\n"
+            + "\n\n".join(sections)
+            + "\n\n"
+            + BATCH_INSTRUCTIONS
+        )
+
+    def _build_prompt(
+        self,
+        pr: Dict,
+        diff: Union[str, Iterable[DiffFile]],
+        since_commit: Optional[str] = None,
+        part: Optional[Tuple[int, int]] = None,
+    ) -> str:
+        header = f"Repository: {self.repo_slug}\n" + _describe_pr(pr, since_commit)
+        if part:
+            header += f"Diff part {part[0]} of {part[1]}; other parts are reviewed separately.\n"
+
+        if not isinstance(diff, str):
+            diff = render_diff(diff)
         truncated_diff = diff
         if len(diff) > self.max_diff_chars:
             # Prevent oversized prompts to the model.
             truncated_diff = diff[: self.max_diff_chars] + "\n... truncated ..."
 
-        instructions = (
-            "Сделай краткий code review этого диффа. Сначала перечисли критичные проблемы, "
-            "затем рекомендации и улучшения. Ответ держи сжато и на русском языке."
+        return header + "\nDiff:\n" + truncated_diff + "\n" + REVIEW_INSTRUCTIONS
+
+
+class _PendingReview:
+    """A PR whose diff is fetched and rendered, waiting for its review."""
+
+    __slots__ = ("pr", "diff", "since", "head", "started")
+
+    def __init__(
+        self, pr: Dict, diff: str, since: Optional[str], head: Optional[str], started: float
+    ) -> None:
+        self.pr = pr
+        self.diff = diff
+        self.since = since
+        self.head = head
+        # When work on the PR began, for the per-PR latency histogram.
+        self.started = started
+
+
+def _describe_pr(pr: Dict, since_commit: Optional[str] = None) -> str:
+    author = pr.get("author", {}) or {}
+    author_name = author.get("display_name") or author.get("nickname") or "unknown"
+    description = (
+        f"Pull Request: #{pr.get('id')} {pr.get('title')}\n"
+        f"Author: {author_name}\n"
+        f"URL: {pr.get('links', {}).get('html', {}).get('href', '')}\n"
+        f"Description:\n{pr.get('description') or 'No description provided.'}\n"
+    )
+    if since_commit:
+        description += (
+            f"Only changes since the last reviewed commit {since_commit[:12]} are shown.\n"
         )
-        return header + "\nDiff:\n" + truncated_diff + "\n" + instructions
+    return description
+
+
+def _completed(pending: Set[Future], wait: bool) -> Iterator[Dict[str, str]]:
+    """Yield results of finished review tasks and forget them; ``wait`` drains them all."""
+    futures = as_completed(list(pending)) if wait else [f for f in pending if f.done()]
+    for future in futures:
+        pending.discard(future)
+        yield from future.result()
+
+
+def _messages(prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _source_commit(pr: Dict) -> Optional[str]:
+    return ((pr.get("source") or {}).get("commit") or {}).get("hash")
+
+
+def _same_commit(first: str, second: str) -> bool:
+    # Webhook payloads carry abbreviated hashes while the REST API returns full ones.
+    return first.startswith(second) or second.startswith(first)
 
 
-def from_env() -> PullRequestAgent:
+def from_env(**options) -> PullRequestAgent:
+    """Build an agent from environment variables; ``options`` are passed through as-is."""
     repo = os.environ.get("BITBUCKET_REPO") or os.environ.get("BITBUCKET_REPO_URL")
     username = os.environ.get("BITBUCKET_USERNAME")
     token = os.environ.get("BITBUCKET_TOKEN")
@@ -148,4 +748,5 @@ def from_env() -> PullRequestAgent:
         bitbucket_api_url=bitbucket_api_url,
         gigachat_url=gigachat_url,
         gigachat_model=gigachat_model,
+        **options,
     )
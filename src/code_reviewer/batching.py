@@ -0,0 +1,60 @@
+import json
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+
+class ReviewBatcher:
+    """Collects small reviews until a batch reaches its size or prompt budget."""
+
+    def __init__(self, max_chars: int, max_size: int = 10) -> None:
+        self.max_chars = max_chars
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items: List[Any] = []
+        self._chars = 0
+
+    def add(self, item: Any, chars: int) -> Optional[List[Any]]:
+        """Queue ``item``; return the batch to send once it is full, else None."""
+        with self._lock:
+            full: Optional[List[Any]] = None
+            # An item that would overflow the budget starts the next batch.
+            if self._items and self._chars + chars > self.max_chars:
+                full = self._take()
+            self._items.append(item)
+            self._chars += chars
+            if full is None and len(self._items) >= self.max_size:
+                full = self._take()
+            return full
+
+    def drain(self) -> List[Any]:
+        with self._lock:
+            return self._take()
+
+    def _take(self) -> List[Any]:
+        items, self._items, self._chars = self._items, [], 0
+        return items
+
+
+def parse_batch_reviews(text: str, pr_ids: Sequence[int]) -> Dict[int, str]:
+    """Split a JSON answer keyed by PR id into per-PR reviews.
+
+    Ids missing from the answer are left out so the caller can review them one by one;
+    an answer that is not a JSON object raises ValueError.
+    """
+    body = text.strip()
+    if body.startswith("```"):
+        # Models like to wrap JSON into a fenced block despite the instructions.
+        body = body.split("\n", 1)[-1].rsplit("```", 1)[0]
+    start, end = body.find("{"), body.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("Batch answer contains no JSON object")
+    data = json.loads(body[start : end + 1])
+    if not isinstance(data, dict):
+        raise ValueError("Batch answer is not a JSON object")
+
+    reviews: Dict[int, str] = {}
+    for pr_id in pr_ids:
+        review = data.get(str(pr_id))
+        if isinstance(review, str) and review.strip():
+            reviews[pr_id] = review.strip()
+    return reviews
@@ -1,7 +1,44 @@
+import codecs
 import logging
-from typing import Dict, List, Optional
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Set
+from urllib.parse import urlencode
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import Metrics
+from .ratelimit import AdaptiveRateLimiter
+
+# Only what the review needs; Bitbucket otherwise returns full PR objects with all links.
+PULL_REQUEST_FIELDS = ",".join(
+    [
+        "next",
+        "values.id",
+        "values.title",
+        "values.description",
+        "values.author.display_name",
+        "values.author.nickname",
+        "values.source.commit.hash",
+        "values.source.branch.name",
+        "values.destination.branch.name",
+        "values.created_on",
+        "values.updated_on",
+        "values.links.html.href",
+    ]
+)
+
+DIFFSTAT_FIELDS = ",".join(
+    [
+        "next",
+        "values.status",
+        "values.lines_added",
+        "values.lines_removed",
+        "values.old.path",
+        "values.new.path",
+    ]
+)
 
 
 class BitbucketClient:
@@ -13,21 +50,43 @@ class BitbucketClient:
         username: str,
         token: str,
         base_url: str = "https://api.bitbucket.org/2.0",
+        pool_size: int = 10,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        etag_cache: Optional[Dict[str, Dict]] = None,
+        metrics: Optional[Metrics] = None,
+        session: Optional[requests.Session] = None,
     ) -> None:
+        # "<workspace>/" is enough for workspace-level calls such as iter_repositories().
         if "/" not in repo_slug:
             raise ValueError("Bitbucket repo slug must look like <workspace>/<repo>")
 
         self.workspace, self.repo = repo_slug.split("/", 1)
         self.base_url = base_url.rstrip("/")
-        self.session = requests.Session()
+        self.metrics = metrics or Metrics()
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter("Bitbucket", metrics=self.metrics)
+        # URL -> {"etag": ..., "data": ...}; callers may persist it between runs.
+        self.etag_cache: Dict[str, Dict] = dict(etag_cache or {})
+        self._requested_etag_keys: Set[str] = set()
+        self._etag_lock = threading.Lock()
+        # A shared session keeps one connection pool for clients of several repositories.
+        self.session = session or self._new_session(username, token, pool_size)
+
+    @staticmethod
+    def _new_session(username: str, token: str, pool_size: int) -> requests.Session:
+        session = requests.Session()
+        # Keep one pooled connection per concurrent worker instead of reconnecting.
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
         # Bitbucket Cloud uses basic auth with username + app password.
-        self.session.auth = (username, token)
-        self.session.headers.update(
+        session.auth = (username, token)
+        session.headers.update(
             {
                 "Accept": "application/json",
                 "User-Agent": "code-review-agent/1.0",
             }
         )
+        return session
 
     def _request(
         self,
@@ -37,27 +96,114 @@ class BitbucketClient:
         params: Optional[Dict] = None,
         headers: Optional[Dict] = None,
         json=None,
+        stream: bool = False,
     ) -> requests.Response:
         url = f"{self.base_url}{path}"
         logging.debug("%s %s params=%s", method, url, params)
-        response = self.session.request(
-            method, url, params=params, headers=headers, json=json, timeout=60
-        )
+        labels = {"backend": "bitbucket", "endpoint": self._endpoint_label(path), "repo": self.slug}
+        started = time.monotonic()
+        try:
+            response = self.rate_limiter.send(
+                lambda: self.session.request(
+                    method,
+                    url,
+                    params=params,
+                    headers=headers,
+                    json=json,
+                    timeout=60,
+                    stream=stream,
+                ),
+                idempotent=method in ("GET", "HEAD"),
+            )
+        except Exception:
+            self.metrics.inc("http_requests_total", status="error", **labels)
+            raise
+        finally:
+            # For streamed responses this is the time to headers; the body is counted later.
+            self.metrics.observe("http_request_seconds", time.monotonic() - started, **labels)
+        self.metrics.inc("http_requests_total", status=str(response.status_code), **labels)
+        if not stream:
+            self.metrics.inc("http_response_bytes_total", len(response.content), **labels)
         if not response.ok:
             raise RuntimeError(f"Bitbucket API error {response.status_code}: {response.text}")
         return response
 
-    def list_open_pull_requests(self) -> List[Dict]:
+    def _iter_text_lines(self, path: str, params: Optional[Dict] = None) -> Iterator[str]:
+        """Stream a plain-text response line by line without loading it into memory."""
+        response = self._request(
+            "GET", path, params=params, headers={"Accept": "text/plain"}, stream=True
+        )
+        # Diffs are UTF-8 whatever the Content-Type says; decode incrementally.
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        received = 0
+        with response:
+            try:
+                pending = ""
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    received += len(chunk)
+                    pending += decoder.decode(chunk)
+                    *lines, pending = pending.split("\n")
+                    yield from lines
+                pending += decoder.decode(b"", final=True)
+                if pending:
+                    yield pending
+            finally:
+                # Also runs when the consumer stops early, so bytes are counted either way.
+                self.metrics.inc(
+                    "http_response_bytes_total",
+                    received,
+                    backend="bitbucket",
+                    endpoint=self._endpoint_label(path),
+                    repo=self.slug,
+                )
+
+    @property
+    def slug(self) -> str:
+        return f"{self.workspace}/{self.repo}"
+
+    def _endpoint_label(self, path: str) -> str:
+        """Collapse a request path into a low-cardinality metrics label."""
+        path = path.split("?", 1)[0]
+        prefix = f"/repositories/{self.workspace}/{self.repo}"
+        if path.startswith(prefix):
+            path = path[len(prefix) :]
+        parts = ["{id}" if part.isdigit() else part for part in path.strip("/").split("/")]
+        if parts[0] in ("diff", "diffstat"):
+            parts = [parts[0], "{spec}"]
+        return "/".join(parts) or "/"
+
+    def list_open_pull_requests(self, updated_after: Optional[str] = None) -> List[Dict]:
         """Return all open PRs with pagination."""
+        return [pr for page in self.iter_open_pull_request_pages(updated_after) for pr in page]
+
+    def iter_open_pull_request_pages(
+        self, updated_after: Optional[str] = None
+    ) -> Iterator[List[Dict]]:
+        """Yield pages of open PRs, optionally only those updated after an ISO timestamp."""
         path = f"/repositories/{self.workspace}/{self.repo}/pullrequests"
-        params: Dict[str, str] = {"state": "OPEN", "pagelen": "50"}
-        results: List[Dict] = []
+        params: Dict[str, str] = {"state": "OPEN", "pagelen": "50", "fields": PULL_REQUEST_FIELDS}
+        if updated_after:
+            params["q"] = f"updated_on > {updated_after}"
+        return self._iter_pages(path, params)
+
+    def iter_repositories(self) -> Iterator[str]:
+        """Yield the ``<workspace>/<repo>`` slugs of every repository in the workspace."""
+        path = f"/repositories/{self.workspace}"
+        params = {"pagelen": "100", "fields": "next,values.full_name"}
+        for page in self._iter_pages(path, params):
+            for repository in page:
+                yield repository["full_name"]
 
+    def _iter_pages(
+        self, path: str, params: Dict[str, str], cached: bool = True
+    ) -> Iterator[List[Dict]]:
         next_path: Optional[str] = path
         while next_path:
-            response = self._request("GET", next_path, params=params)
-            data = response.json()
-            results.extend(data.get("values", []))
+            if cached:
+                data = self._get_json_cached(next_path, params)
+            else:
+                data = self._request("GET", next_path, params=params or None).json()
+            yield data.get("values", [])
 
             next_url = data.get("next")
             if not next_url:
@@ -65,18 +211,81 @@ class BitbucketClient:
             # The `next` link already contains query params; reuse it as-is.
             next_path = next_url.replace(self.base_url, "")
             params = {}  # pagination URL already has query params
-        return results
+
+    def requested_etags(self) -> Dict[str, Dict]:
+        """Return the cached pages requested since the last call, e.g. to persist them.
+
+        Older entries are left out, so a persisted cache does not keep pages nobody asks for.
+        """
+        with self._etag_lock:
+            keys, self._requested_etag_keys = self._requested_etag_keys, set()
+        return {key: self.etag_cache[key] for key in keys if key in self.etag_cache}
+
+    def _get_json_cached(self, path: str, params: Dict[str, str]) -> Dict:
+        """GET JSON with If-None-Match so unchanged pages come back as empty 304s."""
+        key = path + ("?" + urlencode(sorted(params.items())) if params else "")
+        with self._etag_lock:
+            self._requested_etag_keys.add(key)
+        cached = self.etag_cache.get(key)
+        headers = {"If-None-Match": cached["etag"]} if cached else {}
+        response = self._request("GET", path, params=params or None, headers=headers)
+        if response.status_code == 304:
+            logging.debug("Not modified, using cached page for %s", key)
+            return self.etag_cache[key]["data"]
+        data = response.json()
+        etag = response.headers.get("ETag")
+        if etag:
+            self.etag_cache[key] = {"etag": etag, "data": data}
+        return data
 
     def pull_request(self, pr_id: int) -> Dict:
         path = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}"
         return self._request("GET", path).json()
 
-    def pull_request_diff(self, pr_id: int) -> str:
+    def pull_request_diffstat(self, pr_id: int) -> List[Dict]:
+        """Return per-file line counts of the PR without downloading the diff itself."""
+        path = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/diffstat"
+        params = {"pagelen": "500", "fields": DIFFSTAT_FIELDS}
+        # Not ETag-cached: the cache is persisted and would grow with every PR.
+        return [entry for page in self._iter_pages(path, params, cached=False) for entry in page]
+
+    def commit_range_diffstat(self, from_commit: str, to_commit: str) -> List[Dict]:
+        """Per-file line counts between two commits, same spec as iter_commit_range_diff."""
+        path = f"/repositories/{self.workspace}/{self.repo}/diffstat/{to_commit}..{from_commit}"
+        params = {"pagelen": "500", "fields": DIFFSTAT_FIELDS, "topic": "false"}
+        return [entry for page in self._iter_pages(path, params, cached=False) for entry in page]
+
+    def pull_request_diff(self, pr_id: int, context: Optional[int] = None) -> str:
+        return "\n".join(self.iter_pull_request_diff(pr_id, context=context))
+
+    def iter_pull_request_diff(self, pr_id: int, context: Optional[int] = None) -> Iterator[str]:
+        """Yield the PR diff line by line as it is downloaded.
+
+        ``context`` sets the number of unchanged lines around each change (Bitbucket uses 3).
+        """
         path = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/diff"
-        headers = {"Accept": "text/plain"}
-        return self._request("GET", path, headers=headers).text
+        return self._iter_text_lines(path, params=_diff_params(context))
+
+    def commit_range_diff(
+        self, from_commit: str, to_commit: str, context: Optional[int] = None
+    ) -> str:
+        """Return the plain diff of changes made between two commits."""
+        return "\n".join(self.iter_commit_range_diff(from_commit, to_commit, context=context))
+
+    def iter_commit_range_diff(
+        self, from_commit: str, to_commit: str, context: Optional[int] = None
+    ) -> Iterator[str]:
+        # Bitbucket specs read "<new>..<old>"; topic=false asks for a direct two-dot diff
+        # instead of one against the merge base.
+        spec = f"{to_commit}..{from_commit}"
+        path = f"/repositories/{self.workspace}/{self.repo}/diff/{spec}"
+        return self._iter_text_lines(path, params={"topic": "false", **_diff_params(context)})
 
     def comment_pull_request(self, pr_id: int, text: str) -> Dict:
         path = f"/repositories/{self.workspace}/{self.repo}/pullrequests/{pr_id}/comments"
         payload = {"content": {"raw": text}}
         return self._request("POST", path, json=payload).json()
+
+
+def _diff_params(context: Optional[int]) -> Dict[str, str]:
+    return {} if context is None else {"context": str(context)}
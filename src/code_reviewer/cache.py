@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+_HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_diff(diff: str) -> str:
+    """Reduce a diff to the content that matters for review.
+
+    Hunk line numbers, ``index`` lines and whitespace-only differences are dropped so
+    the same change rebased or cherry-picked onto another branch normalizes identically.
+    """
+    lines = []
+    for line in diff.splitlines():
+        if line.startswith("index "):
+            continue
+        if line.startswith("@@"):
+            line = _HUNK_HEADER.sub("@@", line)
+        line = _WHITESPACE.sub(" ", line).rstrip()
+        if not line or line in ("+", "-"):
+            continue
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class ReviewCache:
+    """Size-bounded LRU of model reviews with an optional JSON file backend."""
+
+    def __init__(self, max_entries: int = 1024, path: Optional[str] = None) -> None:
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as handle:
+                # Entries are stored oldest first, so insertion order restores recency.
+                self._entries.update(json.load(handle))
+            self._evict()
+            logging.debug("Loaded %s cached reviews from %s", len(self._entries), path)
+
+    @staticmethod
+    def key(model: str, template: str, diff: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model, template, normalize_diff(diff)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def recheck(self, key: str) -> Optional[str]:
+        """Look up ``key`` again after a miss, e.g. once a worker got its turn.
+
+        When another worker filled the entry in the meantime the earlier miss becomes a hit.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.misses -= 1
+                self.hits += 1
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self._lock:
+            snapshot = dict(self._entries)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(snapshot, handle)
+        os.replace(tmp_path, self.path)
+
+    def _evict(self) -> None:
+        while len(self._entries) > max(self.max_entries, 0):
+            self._entries.popitem(last=False)
@@ -0,0 +1,79 @@
+from typing import List
+
+# Rough average for code; good enough to keep the per-PR cost bounded.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_diff(diff: str, max_chars: int) -> List[str]:
+    """Split a unified diff into pieces of at most ``max_chars`` characters.
+
+    Pieces break at file boundaries first, then at hunk boundaries; a file split across
+    pieces repeats its header so every piece stays self-describing. Only a single hunk
+    larger than ``max_chars`` is cut between lines.
+    """
+    chunks: List[str] = []
+    current = ""
+    for file_diff in _split_before(diff, "diff --git "):
+        for piece in _split_file(file_diff, max_chars):
+            if current and len(current) + len(piece) > max_chars:
+                chunks.append(current)
+                current = ""
+            current += piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _split_file(file_diff: str, max_chars: int) -> List[str]:
+    if len(file_diff) <= max_chars:
+        return [file_diff]
+
+    header, *hunks = _split_before(file_diff, "@@")
+    budget = max(max_chars - len(header), 1)
+    pieces: List[str] = []
+    current = ""
+    for hunk in hunks:
+        for part in _split_lines(hunk, budget):
+            if current and len(current) + len(part) > budget:
+                pieces.append(header + current)
+                current = ""
+            current += part
+    if current or not pieces:
+        pieces.append(header + current)
+    return pieces
+
+
+def _split_lines(text: str, max_chars: int) -> List[str]:
+    if len(text) <= max_chars:
+        return [text]
+    parts: List[str] = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        if current and len(current) + len(line) > max_chars:
+            parts.append(current)
+            current = ""
+        current += line
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _split_before(text: str, marker: str) -> List[str]:
+    """Split ``text`` into blocks that each start with a line beginning with ``marker``.
+
+    Anything before the first marker becomes the leading block.
+    """
+    blocks: List[str] = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        if line.startswith(marker) and current:
+            blocks.append(current)
+            current = ""
+        current += line
+    if current:
+        blocks.append(current)
+    return blocks
@@ -0,0 +1,138 @@
+import posixpath
+import re
+from typing import List, Optional
+
+from .diff_parser import DiffFile, DiffHunk
+
+# Long runs of removed lines are summarized; the first few stay so the model sees what went.
+MAX_DELETED_RUN = 20
+DELETED_PREVIEW = 3
+
+# Files where indentation is syntax, so changing it is never cosmetic.
+_INDENT_SENSITIVE_SUFFIXES = (".py", ".yaml", ".yml")
+_INDENT_SENSITIVE_NAMES = frozenset({"Makefile", "GNUmakefile"})
+_WHITESPACE_RUN = re.compile(r"[ \t]+")
+
+# Header lines that cost tokens but tell the reviewer nothing.
+_NOISE_HEADER_PREFIXES = ("index ", "similarity index ", "dissimilarity index ")
+
+
+class CompactionStats:
+    """Sizes of the diff before and after compaction, for logs and metrics."""
+
+    __slots__ = ("chars_before", "chars_after", "collapsed_files", "dropped_hunks")
+
+    def __init__(self) -> None:
+        self.chars_before = 0
+        self.chars_after = 0
+        self.collapsed_files = 0
+        self.dropped_hunks = 0
+
+    @property
+    def saved_ratio(self) -> float:
+        if not self.chars_before:
+            return 0.0
+        return 1 - self.chars_after / self.chars_before
+
+
+def compact_file(
+    diff_file: DiffFile,
+    stats: Optional[CompactionStats] = None,
+    max_deleted_run: int = MAX_DELETED_RUN,
+) -> DiffFile:
+    """Shrink one parsed file diff in place and return it.
+
+    Renames, mode changes, binaries and deleted files collapse to a one-line note,
+    whitespace-only hunks are dropped and long runs of removed lines are summarized.
+    The ``diff --git`` line is always kept so chunking still splits at file boundaries.
+    """
+    stats = stats if stats is not None else CompactionStats()
+    stats.chars_before += len(diff_file.text())
+
+    git_line = diff_file.header[0]
+    note = _collapsed_note(diff_file)
+    if note is None:
+        keep_indent = _indent_sensitive(diff_file.path)
+        hunks = [hunk for hunk in diff_file.hunks if not _whitespace_only(hunk, keep_indent)]
+        stats.dropped_hunks += len(diff_file.hunks) - len(hunks)
+        if diff_file.hunks and not hunks and not diff_file.omitted_lines:
+            note = "whitespace-only changes"
+        else:
+            diff_file.header = [
+                line for line in diff_file.header if not line.startswith(_NOISE_HEADER_PREFIXES)
+            ]
+            for hunk in hunks:
+                hunk.lines = _summarize_deletions(hunk.lines, max_deleted_run)
+            diff_file.hunks = hunks
+    if note is not None:
+        stats.collapsed_files += 1
+        diff_file.header = [git_line, f"({note})"]
+        diff_file.hunks = []
+        diff_file.omitted_lines = 0
+
+    text_size = len(diff_file.text())
+    diff_file.size = text_size
+    stats.chars_after += text_size
+    return diff_file
+
+
+def _collapsed_note(diff_file: DiffFile) -> Optional[str]:
+    header = diff_file.header
+    if diff_file.binary:
+        return "binary file changed"
+    if any(line.startswith("deleted file mode") for line in header):
+        removed = sum(len(hunk.lines) for hunk in diff_file.hunks) + diff_file.omitted_lines
+        return f"file deleted, {removed} lines removed"
+    if diff_file.hunks or diff_file.omitted_lines:
+        return None
+    if diff_file.old_path != diff_file.path:
+        return f"renamed from {diff_file.old_path} without content changes"
+    modes = [line.split()[-1] for line in header if line.startswith(("old mode", "new mode"))]
+    if len(modes) == 2:
+        return f"mode changed {modes[0]} -> {modes[1]}"
+    return None
+
+
+def _indent_sensitive(path: str) -> bool:
+    name = posixpath.basename(path)
+    return name in _INDENT_SENSITIVE_NAMES or name.endswith(_INDENT_SENSITIVE_SUFFIXES)
+
+
+def _whitespace_only(hunk: DiffHunk, keep_indent: bool) -> bool:
+    """Whether each removed line matches its added line up to ``git diff -b`` changes."""
+    removed = [line[1:] for line in hunk.lines if line.startswith("-")]
+    added = [line[1:] for line in hunk.lines if line.startswith("+")]
+    if not removed or len(removed) != len(added):
+        return False
+    return all(
+        _normalize(old, keep_indent) == _normalize(new, keep_indent)
+        for old, new in zip(removed, added)
+    )
+
+
+def _normalize(line: str, keep_indent: bool) -> str:
+    line = line.rstrip()
+    body = line.lstrip()
+    indent = line[: len(line) - len(body)]
+    if not keep_indent:
+        indent = " " if indent else ""
+    return indent + _WHITESPACE_RUN.sub(" ", body)
+
+
+def _summarize_deletions(lines: List[str], max_deleted_run: int) -> List[str]:
+    result: List[str] = []
+    run: List[str] = []
+    for line in lines + [""]:
+        if line.startswith("-"):
+            run.append(line)
+            continue
+        if len(run) > max_deleted_run:
+            result.extend(run[:DELETED_PREVIEW])
+            result.append(f"... {len(run) - DELETED_PREVIEW} more removed lines ...")
+        else:
+            result.extend(run)
+        run = []
+        result.append(line)
+    # Drop the sentinel appended above.
+    result.pop()
+    return result
@@ -0,0 +1,149 @@
+from fnmatch import fnmatch
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+
+class DiffHunk:
+    """One ``@@`` block of a file diff."""
+
+    __slots__ = ("header", "lines")
+
+    def __init__(self, header: str) -> None:
+        self.header = header
+        self.lines: List[str] = []
+
+    def text(self) -> str:
+        return "\n".join([self.header, *self.lines]) + "\n"
+
+
+class DiffFile:
+    """Header lines and hunks of a single file in a unified git diff."""
+
+    __slots__ = ("path", "old_path", "header", "hunks", "size", "omitted_lines")
+
+    def __init__(self, header: str) -> None:
+        self.path = _path_from_git_header(header)
+        self.old_path = self.path
+        self.header: List[str] = [header]
+        self.hunks: List[DiffHunk] = []
+        # Characters kept so far, used to cap memory for huge files.
+        self.size = len(header) + 1
+        self.omitted_lines = 0
+
+    @property
+    def binary(self) -> bool:
+        return any(line.startswith(("Binary files ", "GIT binary patch")) for line in self.header)
+
+    def text(self) -> str:
+        parts = ["\n".join(self.header) + "\n"]
+        parts.extend(hunk.text() for hunk in self.hunks)
+        if self.omitted_lines:
+            parts.append(f"... {self.omitted_lines} more lines of {self.path} omitted ...\n")
+        return "".join(parts)
+
+
+def path_included(
+    path: str, include: Optional[Sequence[str]] = None, exclude: Optional[Sequence[str]] = None
+) -> bool:
+    """Apply glob filters such as ``*.lock`` or ``vendor/**`` to a repository path."""
+    if include and not any(fnmatch(path, pattern) for pattern in include):
+        return False
+    return not (exclude and any(fnmatch(path, pattern) for pattern in exclude))
+
+
+def parse_unified_diff(
+    lines: Iterable[str],
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+    max_file_chars: Optional[int] = None,
+) -> Iterator[DiffFile]:
+    """Lazily turn git diff lines into :class:`DiffFile` records.
+
+    Files rejected by the path filters are skipped as their lines arrive, and content past
+    ``max_file_chars`` of one file is counted but not kept, so huge or excluded files are
+    never buffered. Closing the iterator closes ``lines`` as well (e.g. an HTTP stream).
+    """
+    current: Optional[DiffFile] = None
+    keep: Optional[bool] = None
+    try:
+        for raw_line in lines:
+            line = raw_line.rstrip("\r\n")
+            if line.startswith("diff --git "):
+                if current is not None and _decide(current, keep, include, exclude):
+                    yield current
+                current, keep = DiffFile(line), None
+            elif current is None:
+                continue
+            elif line.startswith("@@"):
+                if keep is None:
+                    keep = path_included(current.path, include, exclude) or path_included(
+                        current.old_path, include, exclude
+                    )
+                if keep:
+                    _append(current, line, max_file_chars, new_hunk=True)
+            elif keep is not None:
+                # Inside the hunks: keep is decided at the first "@@" of the file.
+                if keep:
+                    _append(current, line, max_file_chars)
+            else:
+                _parse_header_line(current, line)
+        if current is not None and _decide(current, keep, include, exclude):
+            yield current
+    finally:
+        close = getattr(lines, "close", None)
+        if close is not None:
+            close()
+
+
+def render_diff(files: Iterable[DiffFile]) -> str:
+    return "".join(diff_file.text() for diff_file in files)
+
+
+def _decide(
+    diff_file: DiffFile,
+    keep: Optional[bool],
+    include: Optional[Sequence[str]],
+    exclude: Optional[Sequence[str]],
+) -> bool:
+    if keep is not None:
+        return keep
+    # Files without hunks (renames, mode changes, binaries) are filtered here.
+    return path_included(diff_file.path, include, exclude) or path_included(
+        diff_file.old_path, include, exclude
+    )
+
+
+def _append(
+    diff_file: DiffFile, line: str, max_file_chars: Optional[int], new_hunk: bool = False
+) -> None:
+    over_limit = max_file_chars is not None and diff_file.size + len(line) + 1 > max_file_chars
+    # Once a file hits the cap everything after it is dropped, never just a few lines.
+    if diff_file.omitted_lines or over_limit:
+        diff_file.omitted_lines += 1
+        return
+    diff_file.size += len(line) + 1
+    if new_hunk:
+        diff_file.hunks.append(DiffHunk(line))
+    elif diff_file.hunks:
+        diff_file.hunks[-1].lines.append(line)
+
+
+def _parse_header_line(diff_file: DiffFile, line: str) -> None:
+    diff_file.header.append(line)
+    diff_file.size += len(line) + 1
+    if line.startswith("--- a/"):
+        diff_file.old_path = line[len("--- a/") :]
+    elif line.startswith("+++ b/"):
+        diff_file.path = line[len("+++ b/") :]
+    elif line.startswith("rename from "):
+        diff_file.old_path = line[len("rename from ") :]
+    elif line.startswith("rename to "):
+        diff_file.path = line[len("rename to ") :]
+    elif line == "+++ /dev/null":
+        # Deleted file: keep the old path as the one to match filters against.
+        diff_file.path = diff_file.old_path
+
+
+def _path_from_git_header(line: str) -> str:
+    # "diff --git a/<old> b/<new>"; paths with spaces are refined by the ---/+++ lines.
+    _, _, new_path = line.rpartition(" b/")
+    return new_path
@@ -1,7 +1,39 @@
+import codecs
+import json
 import logging
-from typing import Dict, List
+import time
+from typing import Dict, Iterator, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import Metrics
+from .ratelimit import AdaptiveRateLimiter
+
+
+class ChatCompletion:
+    """Model answer plus the timings needed to tell model latency from generation time."""
+
+    __slots__ = ("content", "finish_reason", "usage", "time_to_first_token", "elapsed")
+
+    def __init__(
+        self,
+        content: str,
+        finish_reason: Optional[str] = None,
+        usage: Optional[Dict] = None,
+        time_to_first_token: Optional[float] = None,
+        elapsed: float = 0.0,
+    ) -> None:
+        self.content = content
+        self.finish_reason = finish_reason
+        self.usage = usage or {}
+        self.time_to_first_token = time_to_first_token
+        self.elapsed = elapsed
+
+    @property
+    def truncated(self) -> bool:
+        """True when the answer was cut by the output budget or the deadline."""
+        return self.finish_reason in ("length", "deadline")
 
 
 class GigaChatClient:
@@ -12,10 +44,27 @@ class GigaChatClient:
         token: str,
         base_url: str = "https://gigachat.devices.sberbank.ru/api/v1",
         model: str = "GigaChat",
+        pool_size: int = 10,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        stream: bool = False,
+        max_tokens: Optional[int] = None,
+        deadline: float = 60.0,
+        metrics: Optional[Metrics] = None,
     ) -> None:
         self.base_url = base_url.rstrip("/")
         self.model = model
+        self.metrics = metrics or Metrics()
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter(
+            "GigaChat", rate=2.0, metrics=self.metrics
+        )
+        # Defaults for chat(); complete() can override them per call.
+        self.stream = stream
+        self.max_tokens = max_tokens
+        self.deadline = deadline
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.session.headers.update(
             {
                 "Authorization": f"Bearer {token}",
@@ -24,18 +73,137 @@ class GigaChatClient:
         )
 
     def chat(self, messages: List[Dict[str, str]], temperature: float = 0.2) -> str:
+        return self.complete(messages, temperature=temperature).content
+
+    def complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        *,
+        stream: Optional[bool] = None,
+        max_tokens: Optional[int] = None,
+        deadline: Optional[float] = None,
+        repo: str = "",
+    ) -> ChatCompletion:
+        """Ask the model and return its answer with usage and timing details.
+
+        In streaming mode the answer is collected as it is generated, so hitting
+        ``deadline`` (seconds) returns the partial text instead of failing the request.
+        ``repo`` labels the request metrics with the repository under review.
+        """
+        stream = self.stream if stream is None else stream
+        max_tokens = max_tokens or self.max_tokens
+        deadline = deadline or self.deadline
         url = f"{self.base_url}/chat/completions"
-        payload = {
+        payload: Dict = {
             "model": self.model,
             "messages": messages,
             "temperature": temperature,
         }
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+        if stream:
+            payload["stream"] = True
         logging.debug("POST %s payload keys=%s", url, list(payload.keys()))
-        response = self.session.post(url, json=payload, timeout=60)
+
+        started = time.monotonic()
+        attempt_started = [started]
+
+        def send() -> requests.Response:
+            # Every attempt gets the full timeout; waits for retries must not eat into it.
+            attempt_started[0] = time.monotonic()
+            return self.session.post(url, json=payload, timeout=(10, deadline), stream=stream)
+
+        labels = {
+            "backend": "gigachat",
+            "endpoint": "chat/completions",
+            "model": self.model,
+            "repo": repo,
+        }
+        try:
+            # Completions have no side effects, so every transient failure may be retried.
+            response = self.rate_limiter.send(send)
+        except Exception:
+            self.metrics.inc("http_requests_total", status="error", **labels)
+            raise
+        finally:
+            self.metrics.observe("http_request_seconds", time.monotonic() - started, **labels)
+        self.metrics.inc("http_requests_total", status=str(response.status_code), **labels)
         if not response.ok:
             raise RuntimeError(f"GigaChat API error {response.status_code}: {response.text}")
+        if stream:
+            # The deadline bounds reading the answer, so it starts once the response is here.
+            return self._read_stream(
+                response, started, attempt_started[0], time.monotonic() + deadline, labels
+            )
+
+        self.metrics.inc("http_response_bytes_total", len(response.content), **labels)
         data = response.json()
         try:
-            return data["choices"][0]["message"]["content"]
+            content = data["choices"][0]["message"]["content"]
+            finish_reason = data["choices"][0].get("finish_reason")
         except (KeyError, IndexError) as exc:
             raise RuntimeError(f"Unexpected GigaChat response: {data}") from exc
+        # Without streaming there is no first token to time, only the whole answer.
+        elapsed = time.monotonic() - started
+        return ChatCompletion(content, finish_reason, data.get("usage"), None, elapsed)
+
+    def _read_stream(
+        self,
+        response: requests.Response,
+        started: float,
+        attempt_started: float,
+        deadline_at: float,
+        labels: Dict[str, str],
+    ) -> ChatCompletion:
+        parts: List[str] = []
+        finish_reason: Optional[str] = None
+        usage: Optional[Dict] = None
+        first_token: Optional[float] = None
+        received = [0]
+        with response:
+            try:
+                for event in _iter_sse_data(response, received):
+                    if event == "[DONE]":
+                        break
+                    chunk = json.loads(event)
+                    usage = chunk.get("usage") or usage
+                    for choice in chunk.get("choices", []):
+                        text = (choice.get("delta") or {}).get("content")
+                        if text:
+                            if first_token is None:
+                                first_token = time.monotonic() - attempt_started
+                            parts.append(text)
+                        finish_reason = choice.get("finish_reason") or finish_reason
+                    if time.monotonic() >= deadline_at:
+                        finish_reason = "deadline"
+                        break
+            except requests.RequestException as exc:
+                # A stalled stream still leaves a usable partial review.
+                if not parts:
+                    raise RuntimeError(f"GigaChat stream failed: {exc}") from exc
+                logging.warning("GigaChat stream interrupted, keeping partial answer: %s", exc)
+                finish_reason = "deadline"
+        self.metrics.inc("http_response_bytes_total", received[0], **labels)
+        if not parts:
+            raise RuntimeError("GigaChat stream ended without any content")
+        elapsed = time.monotonic() - started
+        return ChatCompletion("".join(parts), finish_reason, usage, first_token, elapsed)
+
+
+def _iter_sse_data(response: requests.Response, received: List[int]) -> Iterator[str]:
+    """Yield the ``data:`` payloads of a server-sent events stream.
+
+    ``received[0]`` is kept up to date with the number of bytes read so far.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    for chunk in response.iter_content(chunk_size=None):
+        received[0] += len(chunk)
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            if line.startswith("data:"):
+                yield line[len("data:") :].strip()
+    if pending.startswith("data:"):
+        yield pending[len("data:") :].strip()
@@ -0,0 +1,70 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import socket
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class Leases:
+    """Expiring exclusive claims on keys, shared by workers through a common directory.
+
+    A lease is a file in the directory; creating, breaking and releasing leases happen
+    under an ``flock`` on the directory's lock file, so only one process or host (with a
+    shared volume that supports locks) can hold a key. Leases of crashed workers expire
+    after ``ttl`` seconds, and the OS drops the lock itself when its holder dies.
+    """
+
+    def __init__(self, directory: str, ttl: float = 3600.0) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        os.makedirs(directory, exist_ok=True)
+
+    def acquire(self, key: str) -> bool:
+        path = self._path(key)
+        with self._locked():
+            if os.path.exists(path):
+                if not self._expired(path):
+                    return False
+                logging.warning("Breaking expired lease %s held by %s", key, self._holder(path))
+            with open(path, "w", encoding="utf-8") as handle:
+                json.dump({"key": key, "owner": self.owner, "acquired_at": time.time()}, handle)
+        return True
+
+    def release(self, key: str) -> None:
+        path = self._path(key)
+        with self._locked():
+            # Never drop a lease that expired and was taken over by another worker.
+            if self._holder(path) == self.owner:
+                os.remove(path)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        # Leases change only under this lock, so checking a lease and replacing it is atomic.
+        with open(os.path.join(self.directory, ".lock"), "a", encoding="utf-8") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", key) + ".lease")
+
+    def _expired(self, path: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(path) > self.ttl
+        except FileNotFoundError:
+            return True
+
+    @staticmethod
+    def _holder(path: str) -> Optional[str]:
+        try:
+            with open(path, "r", encoding="utf-8") as handle:
+                return json.load(handle).get("owner")
+        except (OSError, ValueError):
+            return None
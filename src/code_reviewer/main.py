@@ -1,15 +1,30 @@
 import argparse
+import json
 import logging
 import os
 import sys
+import time
+from typing import Optional
 
 from .agent import PullRequestAgent, from_env, parse_bitbucket_repo_slug
+from .server import WebhookServer
+from .workspace import parse_shard, sweep_workspace
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Send all open Bitbucket Pull Requests to GigaChat for a quick code review."
     )
+    parser.add_argument(
+        "mode",
+        nargs="?",
+        choices=("review", "serve", "workspace"),
+        default="review",
+        help=(
+            "'review' sweeps all open PRs once; 'serve' reviews PRs from Bitbucket webhooks; "
+            "'workspace' sweeps every repository of a workspace."
+        ),
+    )
     # CLI flags mirror env vars so the agent can run locally or in CI.
     parser.add_argument("--repo-url", help="Bitbucket repo URL or <workspace>/<repo> slug.")
     parser.add_argument("--bitbucket-username", help="Bitbucket username (for app password auth).")
@@ -26,6 +41,204 @@ def parse_args() -> argparse.Namespace:
         help="GigaChat API base url. Defaults to GIGACHAT_API_URL or public endpoint.",
     )
     parser.add_argument("--gigachat-model", default=None, help="GigaChat model name.")
+    parser.add_argument(
+        "--bitbucket-concurrency",
+        type=int,
+        default=None,
+        help="Max parallel Bitbucket requests. Defaults to BITBUCKET_CONCURRENCY or 4.",
+    )
+    parser.add_argument(
+        "--gigachat-concurrency",
+        type=int,
+        default=None,
+        help="Max parallel GigaChat requests. Defaults to GIGACHAT_CONCURRENCY or 2.",
+    )
+    parser.add_argument(
+        "--state-path",
+        default=None,
+        help="JSON file with already reviewed commits. Defaults to REVIEW_STATE_PATH.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=None,
+        help="Max reviews kept in the diff cache (0 disables it). Defaults to 1024.",
+    )
+    parser.add_argument(
+        "--cache-path",
+        default=None,
+        help="JSON file to persist the review cache between runs. Defaults to REVIEW_CACHE_PATH.",
+    )
+    parser.add_argument(
+        "--chunked-review",
+        action="store_true",
+        help="Review diffs over the prompt limit in parallel chunks and merge the results.",
+    )
+    parser.add_argument(
+        "--max-chunks", type=int, default=None, help="Max diff chunks reviewed per PR (8)."
+    )
+    parser.add_argument(
+        "--max-tokens-per-pr",
+        type=int,
+        default=None,
+        help="Approximate prompt token budget for all chunks of one PR (32000).",
+    )
+    parser.add_argument(
+        "--diff-include",
+        action="append",
+        default=None,
+        help="Glob of paths to review (repeatable). Defaults to REVIEW_DIFF_INCLUDE or all.",
+    )
+    parser.add_argument(
+        "--diff-exclude",
+        action="append",
+        default=None,
+        help="Glob of paths to drop from diffs, e.g. '*.lock' or 'vendor/**' (repeatable).",
+    )
+    parser.add_argument(
+        "--no-compact-diff",
+        action="store_true",
+        help="Send the raw diff instead of dropping whitespace-only hunks, renames and the like.",
+    )
+    parser.add_argument(
+        "--diff-context",
+        type=int,
+        default=None,
+        help="Unchanged lines around each change requested from Bitbucket (default 1; "
+        "the server default is 3).",
+    )
+    parser.add_argument(
+        "--batch-pr-chars",
+        type=int,
+        default=None,
+        help="Review PRs whose diff is at most this many chars together in one request (0 = off).",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=None, help="Max PRs per batched request (10)."
+    )
+    parser.add_argument(
+        "--triage",
+        action="store_true",
+        help="Fetch the diffstat of every PR first and review small and urgent PRs first.",
+    )
+    parser.add_argument(
+        "--priority-rule",
+        action="append",
+        default=None,
+        help="Review matching PRs earlier, e.g. 'branch:hotfix/*' or 'path:db/*=500' (repeatable).",
+    )
+    parser.add_argument(
+        "--max-pr-lines",
+        type=int,
+        default=None,
+        help="With --triage, PRs changing more lines are handled per --oversize-action.",
+    )
+    parser.add_argument(
+        "--oversize-action",
+        choices=("defer", "skip"),
+        default=None,
+        help="Review oversized PRs after all others ('defer', default) or not at all ('skip').",
+    )
+    parser.add_argument(
+        "--bitbucket-rps",
+        type=float,
+        default=None,
+        help="Starting Bitbucket request rate per second; lowered when throttled (10).",
+    )
+    parser.add_argument(
+        "--gigachat-rps",
+        type=float,
+        default=None,
+        help="Starting GigaChat request rate per second; lowered when throttled (2).",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=None,
+        help="Retries for throttled or transient HTTP failures per request (5).",
+    )
+    parser.add_argument(
+        "--gigachat-stream",
+        action="store_true",
+        help="Stream completions so a review cut by the deadline is kept, not lost.",
+    )
+    parser.add_argument(
+        "--max-output-tokens",
+        type=int,
+        default=None,
+        help="Max tokens the model may generate per review. Defaults to the model limit.",
+    )
+    parser.add_argument(
+        "--review-deadline",
+        type=float,
+        default=None,
+        help="Seconds to wait for one model answer (60).",
+    )
+    parser.add_argument(
+        "--listen",
+        default=None,
+        help="host:port for the webhook endpoint in serve mode. Defaults to 127.0.0.1:8080.",
+    )
+    parser.add_argument(
+        "--webhook-secret",
+        default=None,
+        help="Secret to verify X-Hub-Signature of webhooks. Defaults to BITBUCKET_WEBHOOK_SECRET.",
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=100, help="Max PRs waiting for review in serve mode."
+    )
+    parser.add_argument(
+        "--coalesce-seconds",
+        type=float,
+        default=2.0,
+        help="Wait this long after the last push to a PR before reviewing it in serve mode.",
+    )
+    parser.add_argument(
+        "--workspace",
+        default=None,
+        help="Workspace to sweep in workspace mode. Defaults to BITBUCKET_WORKSPACE.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Repositories reviewed in parallel in workspace mode. Defaults to the CPU count.",
+    )
+    parser.add_argument(
+        "--shard",
+        default=None,
+        help="Review only shard i of N (e.g. 2/3) of the workspace repositories on this host.",
+    )
+    parser.add_argument(
+        "--lease-dir",
+        default=None,
+        help="Shared directory for PR lease files so parallel workers never review one PR twice.",
+    )
+    parser.add_argument(
+        "--report", default=None, help="Write the combined workspace report (JSON) to this file."
+    )
+    parser.add_argument(
+        "--output",
+        choices=("text", "jsonl"),
+        default="text",
+        help="Print reviews as text blocks or as one JSON object per line, as they complete.",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Write Prometheus metrics to this file at exit (node_exporter textfile collector).",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Expose Prometheus metrics on http://0.0.0.0:<port>/metrics while running.",
+    )
+    parser.add_argument(
+        "--summary-json",
+        default=None,
+        help="Write a JSON summary of the run (timings, tokens, retries, outcomes) to this file.",
+    )
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="Enable debug logging for troubleshooting."
     )
@@ -39,61 +252,279 @@ def main() -> int:
         format="%(asctime)s %(levelname)s %(message)s",
     )
 
+    if args.mode == "workspace":
+        return _sweep_workspace(args)
+
     try:
         agent = _agent_from_args(args)
     except ValueError as exc:
         logging.error(exc)
         return 1
 
+    if args.metrics_port:
+        try:
+            agent.metrics.serve(port=args.metrics_port)
+        except OSError as exc:
+            logging.error("Cannot expose metrics on port %s: %s", args.metrics_port, exc)
+            return 1
+
+    if args.mode == "serve":
+        return _serve(agent, args)
+
+    started = time.monotonic()
+    reviewed = 0
     try:
-        results = agent.review_open_pull_requests()
+        # Each review is printed as soon as it is posted, so a crash loses nothing shown so far.
+        for result in agent.iter_reviews():
+            reviewed += 1
+            _print_result(result, args.output, agent.repo_slug)
     except Exception as exc:  # pylint: disable=broad-except
         logging.error("Failed to review open PRs: %s", exc)
+        _export_metrics(agent, args, time.monotonic() - started)
         return 1
+    _log_run_stats(agent)
+    _export_metrics(agent, args, time.monotonic() - started)
+
+    if not reviewed and args.output == "text":
+        print("No pull requests to review.")
+    return 0
+
+
+def _print_result(result: dict, output: str, repo_slug: str) -> None:
+    if output == "jsonl":
+        print(json.dumps({"repo": repo_slug, **result}, ensure_ascii=False), flush=True)
+        return
+    print(f"[PR #{result['id']}] {result['title']}")
+    if result.get("url"):
+        print(result["url"])
+    print(result["review"])
+    print("-" * 40, flush=True)
 
-    if not results:
-        print("No open pull requests.")
-        return 0
 
-    for pr in results:
-        print(f"[PR #{pr['id']}] {pr['title']}")
-        if pr.get("url"):
-            print(pr["url"])
-        print(pr["review"])
-        print("-" * 40)
+def _serve(agent: PullRequestAgent, args: argparse.Namespace) -> int:
+    host, _, port = (args.listen or "127.0.0.1:8080").rpartition(":")
+    try:
+        server = WebhookServer(
+            agent,
+            host=host or "127.0.0.1",
+            port=int(port),
+            workers=agent.bitbucket_concurrency + agent.gigachat_concurrency,
+            queue_size=args.queue_size,
+            coalesce_seconds=args.coalesce_seconds,
+            secret=args.webhook_secret or os.environ.get("BITBUCKET_WEBHOOK_SECRET"),
+        )
+    except (OSError, ValueError) as exc:
+        logging.error("Cannot listen on %s: %s", args.listen, exc)
+        return 1
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Stopping webhook server")
+    _log_run_stats(agent)
+    _export_metrics(agent, args)
     return 0
 
 
-if __name__ == "__main__":
-    sys.exit(main())
+def _log_run_stats(agent: PullRequestAgent) -> None:
+    logging.info("Review cache: %s hits, %s misses", agent.cache.hits, agent.cache.misses)
+    agent.metrics.set("review_cache_hits", agent.cache.hits, repo=agent.repo_slug)
+    agent.metrics.set("review_cache_misses", agent.cache.misses, repo=agent.repo_slug)
+    for limiter in (agent.bitbucket.rate_limiter, agent.gigachat.rate_limiter):
+        logging.info(
+            "%s: %s retries, %.1fs throttled, final rate %.2f/s",
+            limiter.name,
+            limiter.retries,
+            limiter.throttled_seconds,
+            limiter.rate,
+        )
 
 
-def _agent_from_args(args: argparse.Namespace) -> PullRequestAgent:
-    repo_url = (
-        args.repo_url or os.environ.get("BITBUCKET_REPO") or os.environ.get("BITBUCKET_REPO_URL")
-    )
-    bitbucket_username = args.bitbucket_username or os.environ.get("BITBUCKET_USERNAME")
-    bitbucket_token = args.bitbucket_token or os.environ.get("BITBUCKET_TOKEN")
-    gigachat_token = args.gigachat_token or os.environ.get("GIGACHAT_TOKEN")
-    bitbucket_api_url = args.bitbucket_api_url or os.environ.get(
-        "BITBUCKET_API_URL", "https://api.bitbucket.org/2.0"
-    )
-    gigachat_url = args.gigachat_url or os.environ.get(
-        "GIGACHAT_API_URL", "https://gigachat.devices.sberbank.ru/api/v1"
+def _export_metrics(
+    agent: PullRequestAgent, args: argparse.Namespace, duration: Optional[float] = None
+) -> None:
+    try:
+        if args.metrics_file:
+            agent.metrics.write_prometheus(args.metrics_file)
+        if args.summary_json:
+            agent.metrics.write_summary(
+                args.summary_json,
+                repo=agent.repo_slug,
+                mode=args.mode,
+                duration_seconds=round(duration, 3) if duration is not None else None,
+            )
+    except OSError as exc:
+        logging.error("Failed to write metrics: %s", exc)
+
+
+def _sweep_workspace(args: argparse.Namespace) -> int:
+    # Per-run outputs of a single repository have no workspace counterpart yet.
+    unsupported = [
+        flag
+        for flag, value in (
+            ("--metrics-file", args.metrics_file),
+            ("--metrics-port", args.metrics_port),
+            ("--summary-json", args.summary_json),
+            ("--output jsonl", args.output == "jsonl"),
+        )
+        if value
+    ]
+    if unsupported:
+        logging.error(
+            "Not supported in workspace mode: %s; use --report for the combined JSON report",
+            ", ".join(unsupported),
+        )
+        return 1
+    try:
+        options = {**_connection_options(args), **_agent_options(args)}
+        repo_url = _repo_url(args)
+        workspace = (
+            args.workspace
+            or os.environ.get("BITBUCKET_WORKSPACE")
+            or (repo_url and parse_bitbucket_repo_slug(repo_url).split("/")[0])
+        )
+    except ValueError as exc:
+        logging.error(exc)
+        return 1
+    if not workspace:
+        logging.error("--workspace or BITBUCKET_WORKSPACE must be set")
+        return 1
+    missing = [
+        name
+        for name in ("bitbucket_username", "bitbucket_token", "gigachat_token")
+        if not options[name]
+    ]
+    if missing:
+        logging.error("Missing credentials: %s", ", ".join(missing))
+        return 1
+    try:
+        shard = parse_shard(args.shard or os.environ.get("REVIEW_SHARD", "1/1"))
+    except ValueError as exc:
+        logging.error(exc)
+        return 1
+
+    try:
+        report = sweep_workspace(
+            workspace,
+            options,
+            processes=args.processes or os.cpu_count() or 1,
+            shard=shard,
+        )
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.error("Failed to sweep workspace %s: %s", workspace, exc)
+        return 1
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2, ensure_ascii=False)
+
+    for repo in report["repositories"]:
+        outcome = repo["error"] or ", ".join(
+            f"{count} {name}" for name, count in sorted(repo["outcomes"].items())
+        )
+        print(f"{repo['repo']}: {outcome or 'no open pull requests'}")
+    totals = report["totals"]
+    print(
+        f"Workspace {workspace} shard {report['shard']}: {totals['repositories']} repositories, "
+        f"{totals.get('reviewed', 0)} reviewed, {totals.get('failed', 0)} failed PRs"
     )
-    gigachat_model = args.gigachat_model or os.environ.get("GIGACHAT_MODEL", "GigaChat")
+    return 1 if totals["failed_repositories"] else 0
+
+
+def _agent_from_args(args: argparse.Namespace) -> PullRequestAgent:
+    repo_url = _repo_url(args)
+    connection = _connection_options(args)
+    options = _agent_options(args)
 
-    if repo_url and bitbucket_username and bitbucket_token and gigachat_token:
+    if (
+        repo_url
+        and connection["bitbucket_username"]
+        and connection["bitbucket_token"]
+        and connection["gigachat_token"]
+    ):
         repo_slug = parse_bitbucket_repo_slug(repo_url)
-        return PullRequestAgent(
-            bitbucket_repo=repo_slug,
-            bitbucket_username=bitbucket_username,
-            bitbucket_token=bitbucket_token,
-            gigachat_token=gigachat_token,
-            bitbucket_api_url=bitbucket_api_url,
-            gigachat_url=gigachat_url,
-            gigachat_model=gigachat_model,
-        )
+        return PullRequestAgent(bitbucket_repo=repo_slug, **connection, **options)
 
     logging.debug("Falling back to environment for configuration")
-    return from_env()
+    return from_env(**options)
+
+
+def _repo_url(args: argparse.Namespace) -> Optional[str]:
+    return args.repo_url or os.environ.get("BITBUCKET_REPO") or os.environ.get("BITBUCKET_REPO_URL")
+
+
+def _connection_options(args: argparse.Namespace) -> dict:
+    return {
+        "bitbucket_username": args.bitbucket_username or os.environ.get("BITBUCKET_USERNAME"),
+        "bitbucket_token": args.bitbucket_token or os.environ.get("BITBUCKET_TOKEN"),
+        "gigachat_token": args.gigachat_token or os.environ.get("GIGACHAT_TOKEN"),
+        "bitbucket_api_url": args.bitbucket_api_url
+        or os.environ.get("BITBUCKET_API_URL", "https://api.bitbucket.org/2.0"),
+        "gigachat_url": args.gigachat_url
+        or os.environ.get("GIGACHAT_API_URL", "https://gigachat.devices.sberbank.ru/api/v1"),
+        "gigachat_model": args.gigachat_model or os.environ.get("GIGACHAT_MODEL", "GigaChat"),
+    }
+
+
+def _agent_options(args: argparse.Namespace) -> dict:
+    """Collect tuning options shared by the CLI and the environment fallback."""
+    return {
+        "bitbucket_concurrency": args.bitbucket_concurrency
+        or int(os.environ.get("BITBUCKET_CONCURRENCY", "4")),
+        "gigachat_concurrency": args.gigachat_concurrency
+        or int(os.environ.get("GIGACHAT_CONCURRENCY", "2")),
+        "state_path": args.state_path or os.environ.get("REVIEW_STATE_PATH"),
+        "cache_size": (
+            args.cache_size
+            if args.cache_size is not None
+            else int(os.environ.get("REVIEW_CACHE_SIZE", "1024"))
+        ),
+        "cache_path": args.cache_path or os.environ.get("REVIEW_CACHE_PATH"),
+        "chunked_review": args.chunked_review or os.environ.get("REVIEW_CHUNKED") == "1",
+        "max_chunks": args.max_chunks or int(os.environ.get("REVIEW_MAX_CHUNKS", "8")),
+        "max_tokens_per_pr": args.max_tokens_per_pr
+        or int(os.environ.get("REVIEW_MAX_TOKENS_PER_PR", "32000")),
+        "diff_include": args.diff_include or _env_list("REVIEW_DIFF_INCLUDE"),
+        "diff_exclude": args.diff_exclude or _env_list("REVIEW_DIFF_EXCLUDE"),
+        "compact_diff": not (args.no_compact_diff or os.environ.get("REVIEW_COMPACT_DIFF") == "0"),
+        "diff_context": (
+            args.diff_context
+            if args.diff_context is not None
+            else int(os.environ.get("REVIEW_DIFF_CONTEXT", "1"))
+        ),
+        "batch_pr_chars": (
+            args.batch_pr_chars
+            if args.batch_pr_chars is not None
+            else int(os.environ.get("REVIEW_BATCH_PR_CHARS", "0"))
+        ),
+        "batch_size": args.batch_size or int(os.environ.get("REVIEW_BATCH_SIZE", "10")),
+        "lease_dir": args.lease_dir or os.environ.get("REVIEW_LEASE_DIR"),
+        "triage": args.triage or os.environ.get("REVIEW_TRIAGE") == "1",
+        "priority_rules": args.priority_rule or _env_list("REVIEW_PRIORITY_RULES"),
+        "max_pr_lines": args.max_pr_lines or _env_int("REVIEW_MAX_PR_LINES"),
+        "oversize_action": args.oversize_action
+        or os.environ.get("REVIEW_OVERSIZE_ACTION", "defer"),
+        "bitbucket_rps": args.bitbucket_rps or float(os.environ.get("BITBUCKET_RPS", "10")),
+        "gigachat_rps": args.gigachat_rps or float(os.environ.get("GIGACHAT_RPS", "2")),
+        "max_retries": (
+            args.max_retries
+            if args.max_retries is not None
+            else int(os.environ.get("REVIEW_MAX_RETRIES", "5"))
+        ),
+        "gigachat_stream": args.gigachat_stream or os.environ.get("GIGACHAT_STREAM") == "1",
+        "max_output_tokens": args.max_output_tokens
+        or int(os.environ.get("GIGACHAT_MAX_OUTPUT_TOKENS", "0"))
+        or None,
+        "review_deadline": args.review_deadline or float(os.environ.get("REVIEW_DEADLINE", "60")),
+    }
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def _env_list(name: str) -> list:
+    return [item.strip() for item in os.environ.get(name, "").split(",") if item.strip()]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
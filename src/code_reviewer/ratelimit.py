@@ -0,0 +1,189 @@
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+import requests
+
+from .metrics import Metrics
+
+# Statuses that mean "slow down" rather than "your request is wrong".
+THROTTLE_STATUSES = frozenset({429, 503})
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class AdaptiveRateLimiter:
+    """Token bucket with retries that adapts its rate to backend throttling.
+
+    The refill rate is halved every time the backend throttles and grows back in small
+    steps on success (AIMD), so a sweep settles near the highest rate the backend accepts.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float = 10.0,
+        min_rate: float = 0.2,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        if rate <= 0:
+            raise ValueError(f"{name} request rate must be positive")
+        self.name = name
+        self.metrics = metrics or Metrics()
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retries = 0
+        # Wall-clock time spent paused or backing off; overlapping waits count once.
+        self.throttled_seconds = 0.0
+        self._throttled_until = 0.0
+        self._capacity = max(rate, 1.0)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    # Already counted by _slow_down when the pause was set.
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(
+                        self._capacity, self._tokens + (now - self._updated) * self.rate
+                    )
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def send(
+        self, send_request: Callable[[], requests.Response], idempotent: bool = True
+    ) -> requests.Response:
+        """Send a request through the bucket, retrying throttled and transient failures.
+
+        Non-idempotent requests are only retried when the backend clearly did not process
+        them (throttling statuses or a failed connect).
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                response = send_request()
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                retryable = idempotent or isinstance(exc, requests.ConnectTimeout)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                self._wait_before_retry(
+                    attempt, self._backoff(attempt), str(exc), type(exc).__name__
+                )
+                attempt += 1
+                continue
+
+            self._observe_rate_limit_headers(response)
+            statuses = RETRYABLE_STATUSES if idempotent else THROTTLE_STATUSES
+            if response.status_code not in statuses or attempt >= self.max_retries:
+                if response.ok:
+                    self._speed_up()
+                return response
+
+            delay = _retry_after(response)
+            if response.status_code in THROTTLE_STATUSES:
+                self._slow_down(delay)
+            if delay is None:
+                delay = self._backoff(attempt)
+            response.close()
+            self._wait_before_retry(
+                attempt, delay, f"HTTP {response.status_code}", str(response.status_code)
+            )
+            attempt += 1
+
+    def _wait_before_retry(self, attempt: int, delay: float, reason: str, kind: str) -> None:
+        logging.warning(
+            "%s request failed (%s), retry %s/%s in %.1fs",
+            self.name,
+            reason,
+            attempt + 1,
+            self.max_retries,
+            delay,
+        )
+        with self._lock:
+            self.retries += 1
+            self._count_throttled(time.monotonic() + delay)
+        self.metrics.inc("http_retries_total", backend=self.name.lower(), reason=kind)
+        time.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps parallel workers from retrying in lockstep.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def _slow_down(self, pause: Optional[float] = None) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+            if pause:
+                # Every worker honors the server's pause, not only the one that was told.
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+                self._count_throttled(self._paused_until)
+        logging.info("%s throttled, request rate lowered to %.2f/s", self.name, self.rate)
+
+    def _count_throttled(self, until: float) -> None:
+        # Called with the lock held. Only the part of the wait not counted yet is added, so
+        # N workers sitting out the same pause add it once rather than N times.
+        start = max(time.monotonic(), self._throttled_until)
+        if until > start:
+            self.throttled_seconds += until - start
+            self._throttled_until = until
+            self.metrics.inc("throttled_seconds_total", until - start, backend=self.name.lower())
+
+    def _speed_up(self) -> None:
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def _observe_rate_limit_headers(self, response: requests.Response) -> None:
+        headers = response.headers
+        if headers.get("X-RateLimit-NearLimit", "").lower() == "true":
+            self._slow_down()
+            return
+        if headers.get("X-RateLimit-Remaining") == "0":
+            reset = _to_float(headers.get("X-RateLimit-Reset"))
+            if reset is not None:
+                # Reset is either seconds from now or an absolute epoch timestamp.
+                pause = reset - time.time() if reset > 1e9 else reset
+                self._slow_down(max(pause, 0.0))
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    seconds = _to_float(value)
+    if seconds is not None:
+        return max(seconds, 0.0)
+    try:
+        when = parsedate_to_datetime(value)
+        return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
@@ -0,0 +1,190 @@
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+from .agent import PullRequestAgent
+
+REVIEW_EVENTS = frozenset({"pullrequest:created", "pullrequest:updated"})
+
+
+class ReviewQueue:
+    """Bounded queue of PRs to review that coalesces bursts of pushes to the same PR.
+
+    A PR becomes ready ``coalesce_seconds`` after its latest push, so several pushes in
+    a row produce one review of the newest head. A PR is never handed to two workers at
+    once; pushes that arrive during its review are queued for a follow-up run.
+    """
+
+    def __init__(self, maxsize: int = 100, coalesce_seconds: float = 2.0) -> None:
+        self.maxsize = maxsize
+        self.coalesce_seconds = coalesce_seconds
+        self._pending: "OrderedDict[int, Tuple[float, Dict]]" = OrderedDict()
+        self._in_flight: set = set()
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, pr: Dict) -> bool:
+        """Queue a PR payload; returns False when the queue is full."""
+        pr_id = pr["id"]
+        with self._cond:
+            if pr_id not in self._pending and len(self._pending) >= self.maxsize:
+                return False
+            if pr_id in self._pending:
+                logging.debug("Coalesced push to PR #%s", pr_id)
+            self._pending[pr_id] = (time.monotonic() + self.coalesce_seconds, pr)
+            self._cond.notify_all()
+            return True
+
+    def get(self) -> Optional[Dict]:
+        """Block until a PR is ready to review; returns None once the queue is closed."""
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                wait: Optional[float] = None
+                for pr_id, (ready_at, pr) in self._pending.items():
+                    if pr_id in self._in_flight:
+                        continue
+                    if ready_at <= now:
+                        del self._pending[pr_id]
+                        self._in_flight.add(pr_id)
+                        return pr
+                    wait = ready_at - now if wait is None else min(wait, ready_at - now)
+                self._cond.wait(wait)
+            return None
+
+    def done(self, pr_id: int) -> None:
+        with self._cond:
+            self._in_flight.discard(pr_id)
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+
+class WebhookServer:
+    """HTTP endpoint for Bitbucket PR webhooks that feeds the agent's review logic."""
+
+    def __init__(
+        self,
+        agent: PullRequestAgent,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        workers: int = 2,
+        queue_size: int = 100,
+        coalesce_seconds: float = 2.0,
+        secret: Optional[str] = None,
+    ) -> None:
+        self.agent = agent
+        self.queue = ReviewQueue(maxsize=queue_size, coalesce_seconds=coalesce_seconds)
+        self.secret = secret
+        self.httpd = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._threads = [
+            threading.Thread(target=self._work, name=f"review-worker-{index}", daemon=True)
+            for index in range(workers)
+        ]
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        host, port = self.httpd.server_address[:2]
+        return host, port
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+        threading.Thread(target=self.httpd.serve_forever, name="webhook-http", daemon=True).start()
+        logging.info("Listening for Bitbucket webhooks on http://%s:%s", *self.address)
+
+    def serve_forever(self) -> None:
+        self.start()
+        try:
+            while True:
+                time.sleep(3600)
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.queue.close()
+        for thread in self._threads:
+            thread.join()
+
+    def handle_event(self, event: str, payload: Dict) -> Tuple[int, str]:
+        """Validate a webhook payload and queue its PR; returns an HTTP status and message."""
+        if event not in REVIEW_EVENTS:
+            return 202, f"ignored event {event or 'unknown'}"
+        repo = ((payload.get("repository") or {}).get("full_name") or "").lower()
+        if repo and repo != self.agent.repo_slug.lower():
+            return 202, f"ignored repository {repo}"
+        pr = payload.get("pullrequest") or {}
+        if pr.get("id") is None:
+            return 400, "payload has no pullrequest.id"
+        if (pr.get("state") or "OPEN") != "OPEN":
+            return 202, f"ignored {pr['state'].lower()} pull request"
+        if not self.queue.put(pr):
+            return 503, "review queue is full"
+        logging.info("Queued PR #%s from %s", pr["id"], event)
+        return 202, "queued"
+
+    def verify_signature(self, body: bytes, signature: Optional[str]) -> bool:
+        if not self.secret:
+            return True
+        expected = "sha256=" + hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature or "")
+
+    def _work(self) -> None:
+        while True:
+            pr = self.queue.get()
+            if pr is None:
+                return
+            try:
+                self.agent.review_pull_request(pr)
+                self.agent.cache.save()
+            except Exception as exc:  # pylint: disable=broad-except
+                logging.error("Webhook review of PR #%s failed: %s", pr.get("id"), exc)
+            finally:
+                self.queue.done(pr["id"])
+
+
+def _handler_for(server: WebhookServer) -> type:
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:  # pylint: disable=invalid-name
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length)
+            if not server.verify_signature(body, self.headers.get("X-Hub-Signature")):
+                self._reply(401, "bad signature")
+                return
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                self._reply(400, "invalid JSON")
+                return
+            status, message = server.handle_event(self.headers.get("X-Event-Key", ""), payload)
+            self._reply(status, message)
+
+        def _reply(self, status: int, message: str) -> None:
+            body = json.dumps({"status": message}).encode()
+            self.send_response(status)
+            if status == 503:
+                self.send_header("Retry-After", "5")
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:  # pylint: disable=redefined-builtin
+            logging.debug("webhook %s " + format, self.address_string(), *args)
+
+    return WebhookHandler
@@ -0,0 +1,67 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+
+class ReviewState:
+    """JSON-backed record of the last reviewed source commit of every pull request."""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        # Without a path the state lives only for the current run.
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict = {"pull_requests": {}}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as handle:
+                self._data = json.load(handle)
+            self._data.setdefault("pull_requests", {})
+            logging.debug("Loaded review state from %s", path)
+        self._data.setdefault("listings", {})
+
+    def last_commit(self, repo_slug: str, pr_id: int) -> Optional[str]:
+        with self._lock:
+            entry = self._data["pull_requests"].get(repo_slug, {}).get(str(pr_id))
+        return entry.get("commit") if entry else None
+
+    def record(self, repo_slug: str, pr_id: int, commit_hash: str) -> None:
+        """Remember that ``commit_hash`` of the PR was reviewed and persist immediately."""
+        with self._lock:
+            repo = self._data["pull_requests"].setdefault(repo_slug, {})
+            repo[str(pr_id)] = {
+                "commit": commit_hash,
+                "reviewed_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self._save()
+
+    def listing_cursor(self, repo_slug: str) -> Optional[str]:
+        """Return the ``updated_on`` bound for the next listing, set by the last clean sweep."""
+        with self._lock:
+            return self._data["listings"].get(repo_slug, {}).get("updated_after")
+
+    def etags(self, repo_slug: str) -> Dict[str, Dict]:
+        with self._lock:
+            return dict(self._data["listings"].get(repo_slug, {}).get("etags", {}))
+
+    def record_listing(
+        self, repo_slug: str, etags: Dict[str, Dict], updated_after: Optional[str] = None
+    ) -> None:
+        with self._lock:
+            listing = self._data["listings"].setdefault(repo_slug, {})
+            listing["etags"] = etags
+            if updated_after:
+                listing["updated_after"] = updated_after
+            self._save()
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file first so a crash never leaves a half-written state file.
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(self._data, handle, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,106 @@
+from datetime import datetime, timezone
+from fnmatch import fnmatch
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from .diff_parser import path_included
+
+# One hour of waiting counts like ten fewer changed lines, so big PRs are not starved forever.
+AGE_BONUS_PER_HOUR = 10.0
+DEFAULT_RULE_WEIGHT = 1000.0
+
+
+class DiffStat:
+    """Changed paths and line counts of a PR, from Bitbucket's diffstat endpoint."""
+
+    __slots__ = ("paths", "lines_added", "lines_removed")
+
+    def __init__(self, paths: List[str], lines_added: int, lines_removed: int) -> None:
+        self.paths = paths
+        self.lines_added = lines_added
+        self.lines_removed = lines_removed
+
+    @property
+    def changed_lines(self) -> int:
+        return self.lines_added + self.lines_removed
+
+    @classmethod
+    def from_entries(
+        cls,
+        entries: Iterable[Dict],
+        include: Optional[Sequence[str]] = None,
+        exclude: Optional[Sequence[str]] = None,
+    ) -> "DiffStat":
+        """Sum up diffstat entries, counting only paths that pass the diff filters."""
+        paths: List[str] = []
+        added = removed = 0
+        for entry in entries:
+            path = ((entry.get("new") or entry.get("old")) or {}).get("path", "")
+            if not path_included(path, include, exclude):
+                continue
+            paths.append(path)
+            added += entry.get("lines_added") or 0
+            removed += entry.get("lines_removed") or 0
+        return cls(paths, added, removed)
+
+
+class PriorityRule:
+    """Moves matching PRs up the queue, e.g. ``branch:hotfix/*`` or ``path:db/*=500``."""
+
+    __slots__ = ("kind", "pattern", "weight")
+
+    def __init__(self, kind: str, pattern: str, weight: float = DEFAULT_RULE_WEIGHT) -> None:
+        if kind not in ("branch", "path"):
+            raise ValueError(f"Priority rule kind must be 'branch' or 'path', got {kind!r}")
+        self.kind = kind
+        self.pattern = pattern
+        self.weight = weight
+
+    @classmethod
+    def parse(cls, value: str) -> "PriorityRule":
+        kind, _, rest = value.partition(":")
+        if not rest:
+            raise ValueError(f"Priority rule must look like branch:<glob> or path:<glob>: {value}")
+        pattern, _, weight = rest.rpartition("=") if "=" in rest else (rest, "", "")
+        try:
+            return cls(kind, pattern, float(weight) if weight else DEFAULT_RULE_WEIGHT)
+        except ValueError as exc:
+            raise ValueError(f"Invalid priority rule {value!r}: {exc}") from exc
+
+    def matches(self, pr: Dict, stat: Optional[DiffStat]) -> bool:
+        if self.kind == "branch":
+            return fnmatch(_source_branch(pr), self.pattern)
+        return stat is not None and any(fnmatch(path, self.pattern) for path in stat.paths)
+
+
+def priority(
+    pr: Dict,
+    stat: Optional[DiffStat],
+    rules: Sequence[PriorityRule] = (),
+    now: Optional[datetime] = None,
+    unknown_size: int = 500,
+) -> float:
+    """Score a PR for the review queue; lower scores are reviewed first.
+
+    The score is the number of changed lines, minus a bonus for waiting time and the
+    weights of matching rules. PRs without a diffstat count as ``unknown_size`` lines.
+    """
+    score = float(stat.changed_lines if stat is not None else unknown_size)
+    created = _parse_time(pr.get("created_on") or pr.get("updated_on"))
+    if created is not None:
+        age_hours = ((now or datetime.now(timezone.utc)) - created).total_seconds() / 3600
+        score -= max(age_hours, 0.0) * AGE_BONUS_PER_HOUR
+    return score - sum(rule.weight for rule in rules if rule.matches(pr, stat))
+
+
+def _source_branch(pr: Dict) -> str:
+    return ((pr.get("source") or {}).get("branch") or {}).get("name") or ""
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
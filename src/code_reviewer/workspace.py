@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .agent import PullRequestAgent
+from .bitbucket_client import BitbucketClient
+
+# Metrics registry, HTTP sessions and rate limiters of the first repository a worker process
+# reviews, passed to the agents of the next ones so connections stay warm and the limits
+# hold per process.
+_worker_clients: Dict = {}
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse ``i/N`` with ``i`` from 1 to N into ``(i, N)``."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError as exc:
+        raise ValueError(f"Shard must look like i/N, got {value!r}") from exc
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Shard index must be between 1 and {count}, got {value!r}")
+    return index, count
+
+
+def in_shard(repo_slug: str, shard: Tuple[int, int]) -> bool:
+    # A stable hash, unlike hash(), so every host computes the same split.
+    index, count = shard
+    digest = hashlib.sha1(repo_slug.lower().encode("utf-8")).hexdigest()
+    return int(digest, 16) % count == index - 1
+
+
+def list_repositories(
+    workspace: str,
+    username: str,
+    token: str,
+    base_url: str = "https://api.bitbucket.org/2.0",
+) -> List[str]:
+    client = BitbucketClient(f"{workspace}/", username, token, base_url=base_url, pool_size=1)
+    return sorted(client.iter_repositories())
+
+
+def sweep_workspace(
+    workspace: str,
+    agent_options: Dict,
+    processes: int = 4,
+    shard: Tuple[int, int] = (1, 1),
+    repositories: Optional[Iterable[str]] = None,
+) -> Dict:
+    """Review open PRs of every repository of this shard and return one combined report.
+
+    ``agent_options`` are PullRequestAgent arguments shared by all repositories;
+    ``state_path`` and ``cache_path`` name directories that get one file per repository.
+    Repositories are spread over ``processes`` worker processes.
+    """
+    started = time.monotonic()
+    if repositories is None:
+        repositories = list_repositories(
+            workspace,
+            agent_options["bitbucket_username"],
+            agent_options["bitbucket_token"],
+            agent_options.get("bitbucket_api_url", "https://api.bitbucket.org/2.0"),
+        )
+    selected = [slug for slug in repositories if in_shard(slug, shard)]
+    logging.info(
+        "Workspace %s shard %s/%s: %s repositories", workspace, shard[0], shard[1], len(selected)
+    )
+
+    reports: List[Dict] = []
+    if processes <= 1:
+        clients: Dict = {}
+        reports = [review_repository(slug, agent_options, clients) for slug in selected]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(review_repository, slug, agent_options) for slug in selected]
+            for future in as_completed(futures):
+                report = future.result()
+                logging.info("Finished %s (%s/%s)", report["repo"], len(reports) + 1, len(futures))
+                reports.append(report)
+    reports.sort(key=lambda report: report["repo"])
+
+    totals: Counter = Counter()
+    for report in reports:
+        totals.update(report["outcomes"])
+    return {
+        "workspace": workspace,
+        "shard": f"{shard[0]}/{shard[1]}",
+        "duration_seconds": round(time.monotonic() - started, 3),
+        "totals": {
+            "repositories": len(reports),
+            "failed_repositories": sum(1 for report in reports if report["error"]),
+            **totals,
+        },
+        "repositories": reports,
+    }
+
+
+def review_repository(repo_slug: str, agent_options: Dict, clients: Optional[Dict] = None) -> Dict:
+    """Run one sweep of ``repo_slug``; errors end up in the report instead of raising.
+
+    ``clients`` holds the clients shared with other repositories of the same sweep,
+    by default those of the current worker process.
+    """
+    started = time.monotonic()
+    report: Dict = {"repo": repo_slug, "outcomes": {}, "pull_requests": [], "error": None}
+    clients = _worker_clients if clients is None else clients
+    try:
+        agent = PullRequestAgent(
+            bitbucket_repo=repo_slug, **_repo_options(repo_slug, agent_options), **clients
+        )
+        if not clients:
+            clients.update(
+                metrics=agent.metrics,
+                bitbucket_session=agent.bitbucket.session,
+                bitbucket_rate_limiter=agent.bitbucket.rate_limiter,
+                gigachat=agent.gigachat,
+            )
+        # Review texts are already posted as comments; the report keeps only references.
+        for result in agent.iter_reviews():
+            report["pull_requests"].append(
+                {"id": result["id"], "title": result["title"], "url": result["url"]}
+            )
+        # The registry is shared by the worker's repositories; every series has a repo label.
+        for series in agent.metrics.summary()["counters"].get("pull_requests_total", []):
+            if series["labels"]["repo"] == agent.repo_slug:
+                report["outcomes"][series["labels"]["outcome"]] = int(series["value"])
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.error("Failed to sweep %s: %s", repo_slug, exc)
+        report["error"] = str(exc)
+    report["duration_seconds"] = round(time.monotonic() - started, 3)
+    return report
+
+
+def _repo_options(repo_slug: str, agent_options: Dict) -> Dict:
+    options = dict(agent_options)
+    # Separate files per repository, so processes never rewrite each other's JSON.
+    file_name = repo_slug.replace("/", "__") + ".json"
+    for key in ("state_path", "cache_path"):
+        if options.get(key):
+            options[key] = os.path.join(options[key], file_name)
+    return options
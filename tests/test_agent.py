@@ -1,4 +1,16 @@
-from code_reviewer.agent import PullRequestAgent, parse_bitbucket_repo_slug
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from code_reviewer.agent import (
+    LISTING_OVERLAP,
+    TRUNCATED_NOTE,
+    PullRequestAgent,
+    parse_bitbucket_repo_slug,
+)
+from code_reviewer.gigachat_client import ChatCompletion
+from code_reviewer.lease import Leases
 
 
 def test_parse_bitbucket_repo_slug_accepts_url_and_slug():
@@ -29,3 +41,412 @@ def test_prompt_truncates_large_diff():
     assert "... truncated ..." in prompt
     assert "Diff:" in prompt
     assert "Pull Request: #7" in prompt
+
+
+def _one_file_diff(path, line="+changed"):
+    return f"diff --git a/{path} b/{path}\n@@ -1 +1 @@\n{line}\n"
+
+
+class FakeBitbucket:
+    def __init__(self, prs):
+        self.prs = prs
+        self.comments = {}
+        self.listed_after = []
+
+    def iter_open_pull_request_pages(self, updated_after=None):
+        self.listed_after.append(updated_after)
+        yield [
+            pr for pr in self.prs if not updated_after or pr.get("updated_on", "") > updated_after
+        ]
+
+    def requested_etags(self):
+        return {}
+
+    def pull_request_diff(self, pr_id):
+        if pr_id == 2:
+            raise RuntimeError("Bitbucket API error 500: boom")
+        return _one_file_diff(f"pr{pr_id}.py")
+
+    def iter_pull_request_diff(self, pr_id, context=None):
+        return iter(self.pull_request_diff(pr_id).splitlines())
+
+    def iter_commit_range_diff(self, from_commit, to_commit, context=None):
+        return iter(self.commit_range_diff(from_commit, to_commit).splitlines())
+
+    def comment_pull_request(self, pr_id, text):
+        self.comments[pr_id] = text
+        return {}
+
+
+class FakeGigaChat:
+    model = "GigaChat"
+
+    def complete(self, messages, **kwargs):
+        return ChatCompletion(self.chat(messages))
+
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def chat(self, messages):
+        with self.lock:
+            self.active += 1
+            self.calls += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        return "review: " + messages[-1]["content"].split("Diff:\n")[1].splitlines()[0]
+
+
+def test_review_runs_concurrently_with_limits_and_isolates_errors():
+    agent = PullRequestAgent(
+        bitbucket_repo="team/repo",
+        bitbucket_username="user",
+        bitbucket_token="token",
+        gigachat_token="giga",
+        bitbucket_concurrency=3,
+        gigachat_concurrency=2,
+    )
+    agent.bitbucket = FakeBitbucket(
+        [{"id": pr_id, "title": f"PR {pr_id}"} for pr_id in range(1, 9)]
+    )
+    agent.gigachat = FakeGigaChat()
+
+    results = agent.review_open_pull_requests()
+
+    assert [result["id"] for result in results] == [1, 3, 4, 5, 6, 7, 8]
+    assert results[0]["review"] == "review: diff --git a/pr1.py b/pr1.py"
+    assert 2 not in agent.bitbucket.comments
+    assert agent.gigachat.peak == 2
+    outcomes = {
+        series["labels"]["outcome"]: series["value"]
+        for series in agent.metrics.summary()["counters"]["pull_requests_total"]
+    }
+    assert outcomes == {"reviewed": 7, "failed": 1}
+
+
+class RangeBitbucket(FakeBitbucket):
+    def __init__(self, prs):
+        super().__init__(prs)
+        self.full_diffs = []
+        self.range_diffs = []
+
+    def pull_request_diff(self, pr_id):
+        self.full_diffs.append(pr_id)
+        return _one_file_diff(f"pr{pr_id}.py")
+
+    def commit_range_diff(self, from_commit, to_commit):
+        self.range_diffs.append((from_commit, to_commit))
+        return _one_file_diff(f"{from_commit}..{to_commit}.py")
+
+
+def test_review_skips_unchanged_and_reviews_new_commits_incrementally(tmp_path):
+    agent = PullRequestAgent(
+        bitbucket_repo="team/repo",
+        bitbucket_username="user",
+        bitbucket_token="token",
+        gigachat_token="giga",
+        state_path=str(tmp_path / "state.json"),
+    )
+    agent.state.record("team/repo", 1, "aaa")
+    agent.state.record("team/repo", 2, "bbb")
+    agent.bitbucket = RangeBitbucket(
+        [
+            {"id": 1, "source": {"commit": {"hash": "aaa"}}},
+            {"id": 2, "source": {"commit": {"hash": "ccc"}}},
+            {"id": 3, "source": {"commit": {"hash": "ddd"}}},
+        ]
+    )
+    agent.gigachat = FakeGigaChat()
+
+    results = agent.review_open_pull_requests()
+
+    assert [result["id"] for result in results] == [2, 3]
+    assert agent.bitbucket.range_diffs == [("bbb", "ccc")]
+    assert agent.bitbucket.full_diffs == [3]
+    assert agent.state.last_commit("team/repo", 2) == "ccc"
+    assert agent.state.last_commit("team/repo", 3) == "ddd"
+
+
+class SameDiffBitbucket(FakeBitbucket):
+    def pull_request_diff(self, pr_id):
+        # The same hunk landed at different line numbers, e.g. after a rebase.
+        return (
+            f"diff --git a/app.py b/app.py\nindex {pr_id}..ff\n@@ -{pr_id},2 +{pr_id},2 @@\n-a\n+b"
+        )
+
+
+def test_review_reuses_cached_review_for_identical_hunks():
+    agent = PullRequestAgent(
+        bitbucket_repo="team/repo",
+        bitbucket_username="user",
+        bitbucket_token="token",
+        gigachat_token="giga",
+        gigachat_concurrency=1,
+    )
+    agent.bitbucket = SameDiffBitbucket([{"id": 10}, {"id": 20}])
+    agent.gigachat = FakeGigaChat()
+
+    results = agent.review_open_pull_requests()
+
+    assert len(results) == 2
+    assert agent.gigachat.calls == 1
+    assert (agent.cache.hits, agent.cache.misses) == (1, 1)
+    assert agent.bitbucket.comments[10] == agent.bitbucket.comments[20]
+
+
+class BigDiffBitbucket(FakeBitbucket):
+    def pull_request_diff(self, pr_id):
+        return "".join(
+            f"diff --git a/f{i}.py b/f{i}.py\n@@ -1 +1 @@\n-{'x' * 40}\n+{'y' * 40}\n"
+            for i in range(6)
+        )
+
+
+class RecordingGigaChat(FakeGigaChat):
+    def __init__(self):
+        super().__init__()
+        self.prompts = []
+
+    def chat(self, messages):
+        with self.lock:
+            self.prompts.append(messages[-1]["content"])
+        return f"partial {len(self.prompts)}"
+
+
+def test_chunked_review_maps_pieces_and_reduces_within_caps():
+    agent = PullRequestAgent(
+        bitbucket_repo="team/repo",
+        bitbucket_username="user",
+        bitbucket_token="token",
+        gigachat_token="giga",
+        max_diff_chars=200,
+        chunked_review=True,
+        max_chunks=2,
+    )
+    agent.bitbucket = BigDiffBitbucket([{"id": 1, "title": "Huge"}])
+    agent.gigachat = RecordingGigaChat()
+
+    results = agent.review_open_pull_requests()
+
+    map_prompts, reduce_prompt = agent.gigachat.prompts[:2], agent.gigachat.prompts[2]
+    assert len(agent.gigachat.prompts) == 3
+    assert all("Diff part" in prompt and "truncated" not in prompt for prompt in map_prompts)
+    assert "Part 2 of 2" in reduce_prompt
+    assert "2 more parts of the diff were not reviewed" in reduce_prompt
+    assert results[0]["review"] == "partial 3"
+
+
+class CutOffGigaChat(RecordingGigaChat):
+    def complete(self, messages, **kwargs):
+        content = self.chat(messages)
+        # Only the first map answer runs out of output budget.
+        return ChatCompletion(content, "length" if content == "partial 1" else "stop")
+
+
+def test_cut_off_chunked_review_is_not_cached():
+    agent = PullRequestAgent(
+        bitbucket_repo="team/repo",
+        bitbucket_username="user",
+        bitbucket_token="token",
+        gigachat_token="giga",
+        max_diff_chars=200,
+        chunked_review=True,
+        max_chunks=2,
+    )
+    # Updated after any listing cursor, so the second sweep lists the PR again.
+    agent.bitbucket = BigDiffBitbucket(
+        [{"id": 1, "title": "Huge", "updated_on": "9999-01-01T00:00:00+00:00"}]
+    )
+    agent.gigachat = CutOffGigaChat()
+
+    agent.review_open_pull_requests()
+    agent.review_open_pull_requests()
+
+    assert TRUNCATED_NOTE.strip() in agent.gigachat.prompts[2]
+    # Nothing was reused: the second sweep asked the model again.
+    assert len(agent.gigachat.prompts) == 6
+    assert agent.cache.hits == 0
+
+
+def test_listing_cursor_advances_only_after_a_clean_sweep(tmp_path):
+    agent = PullRequestAgent(
+        bitbucket_repo="team/repo",
+        bitbucket_username="user",
+        bitbucket_token="token",
+        gigachat_token="giga",
+        state_path=str(tmp_path / "state.json"),
+    )
+    agent.bitbucket = FakeBitbucket(
+        [
+            {"id": 1, "updated_on": "2024-01-02T00:00:00+00:00"},
+            {"id": 2, "updated_on": "2024-01-01T00:00:00+00:00"},
+        ]
+    )
+    agent.gigachat = FakeGigaChat()
+
+    agent.review_open_pull_requests()
+    assert agent.state.listing_cursor("team/repo") is None
+
+    agent.bitbucket.prs = [{"id": 3, "updated_on": "2024-01-03T00:00:00+00:00"}]
+    before = datetime.now(timezone.utc)
+    agent.review_open_pull_requests()
+    after = datetime.now(timezone.utc)
+    agent.review_open_pull_requests()
+
+    listed_after = agent.bitbucket.listed_after
+    assert listed_after[:2] == [None, None]
+    # The cursor is the start of the clean listing rounded down to the hour, not the newest
+    # PR it saw.
+    cursor = datetime.fromisoformat(listed_after[2])
+    assert (cursor.minute, cursor.second, cursor.microsecond) == (0, 0, 0)
+    assert before - LISTING_OVERLAP - timedelta(hours=1) < cursor <= after - LISTING_OVERLAP
+
+
+class BatchGigaChat(FakeGigaChat):
+    def __init__(self):
+        super().__init__()
+        self.batch_prompts = []
+
+    def chat(self, messages):
+        prompt = messages[-1]["content"]
+        with self.lock:
+            self.calls += 1
+        if "JSON" not in prompt:
+            return "single review"
+        self.batch_prompts.append(prompt)
+        # PR 5 is left out of the answer and must be reviewed on its own.
+        return '```json\n{"1": "batched 1", "3": "batched 3", "4": "batched 4"}\n```'
+
+
+def test_small_prs_are_batched_into_one_request_with_fallback():
+    agent = PullRequestAgent(
+        bitbucket_repo="team/repo",
+        bitbucket_username="user",
+        bitbucket_token="token",
+        gigachat_token="giga",
+        batch_pr_chars=500,
+    )
+    agent.bitbucket = FakeBitbucket(
+        [{"id": pr_id, "title": f"PR {pr_id}"} for pr_id in range(1, 6)]
+    )
+    agent.gigachat = BatchGigaChat()
+
+    results = agent.review_open_pull_requests()
+
+    assert [result["id"] for result in results] == [1, 3, 4, 5]
+    assert agent.gigachat.calls == 2
+    assert len(agent.gigachat.batch_prompts) == 1
+    assert "Pull Request: #5" in agent.gigachat.batch_prompts[0]
+    assert agent.bitbucket.comments == {
+        1: "batched 1",
+        3: "batched 3",
+        4: "batched 4",
+        5: "single review",
+    }
+
+
+def test_pr_leased_by_another_worker_is_skipped(tmp_path):
+    agent = PullRequestAgent(
+        bitbucket_repo="team/repo",
+        bitbucket_username="user",
+        bitbucket_token="token",
+        gigachat_token="giga",
+        lease_dir=str(tmp_path),
+    )
+    agent.bitbucket = FakeBitbucket([{"id": 1}, {"id": 3}])
+    agent.gigachat = FakeGigaChat()
+    other = Leases(str(tmp_path))
+    other.owner = "other-host:1"
+    assert other.acquire("team/repo#3")
+
+    results = agent.review_open_pull_requests()
+
+    assert [result["id"] for result in results] == [1]
+    assert 3 not in agent.bitbucket.comments
+    assert agent.leases.acquire("team/repo#1")
+    # The other worker may crash, so the leased PR has to be listed again.
+    assert agent.state.listing_cursor("team/repo") is None
+
+
+class DiffstatBitbucket(FakeBitbucket):
+    SIZES = {1: 800, 2: 40, 3: 5000, 4: 300, 5: 0}
+
+    def __init__(self, prs):
+        super().__init__(prs)
+        self.diffs = []
+
+    def pull_request_diffstat(self, pr_id):
+        path = "README.lock" if pr_id == 5 else f"pr{pr_id}.py"
+        return [{"new": {"path": path}, "lines_added": self.SIZES[pr_id], "lines_removed": 0}]
+
+    def pull_request_diff(self, pr_id):
+        self.diffs.append(pr_id)
+        return _one_file_diff(f"pr{pr_id}.py")
+
+
+def test_triage_orders_by_size_and_rules_before_downloading_diffs():
+    agent = PullRequestAgent(
+        bitbucket_repo="team/repo",
+        bitbucket_username="user",
+        bitbucket_token="token",
+        gigachat_token="giga",
+        triage=True,
+        priority_rules=["branch:hotfix/*"],
+        max_pr_lines=1000,
+        diff_exclude=["*.lock"],
+    )
+    prs = [{"id": pr_id, "title": f"PR {pr_id}"} for pr_id in range(1, 6)]
+    prs[3]["source"] = {"branch": {"name": "hotfix/urgent"}}
+    agent.bitbucket = DiffstatBitbucket(prs)
+    agent.gigachat = FakeGigaChat()
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        scheduled = agent._schedule(prs, pool)  # pylint: disable=protected-access
+
+    # Hotfix first, then by size; the oversized PR waits and the lock-only PR is dropped.
+    assert [pr["id"] for pr in scheduled] == [4, 2, 1, 3]
+
+    agent.oversize_action = "skip"
+    results = agent.review_open_pull_requests()
+
+    assert sorted(result["id"] for result in results) == [1, 2, 4]
+    assert sorted(agent.bitbucket.diffs) == [1, 2, 4]
+
+
+def test_iter_reviews_streams_results_and_stops_cleanly(tmp_path):
+    agent = PullRequestAgent(
+        bitbucket_repo="team/repo",
+        bitbucket_username="user",
+        bitbucket_token="token",
+        gigachat_token="giga",
+        bitbucket_concurrency=1,
+        gigachat_concurrency=1,
+        state_path=str(tmp_path / "state.json"),
+    )
+    agent.bitbucket = RangeBitbucket(
+        [
+            {"id": pr_id, "updated_on": f"2024-01-{pr_id:02d}T00:00:00+00:00"}
+            for pr_id in range(1, 21)
+        ]
+    )
+    agent.gigachat = FakeGigaChat()
+
+    reviews = agent.iter_reviews()
+    first = next(reviews)
+    reviews.close()
+
+    assert first["id"] in agent.bitbucket.comments
+    assert len(agent.bitbucket.comments) < 20
+    # An interrupted sweep must list the remaining PRs again next time.
+    assert agent.state.listing_cursor("team/repo") is None
+
+    remaining = list(agent.iter_reviews())
+
+    assert len(agent.bitbucket.comments) == 20
+    # Without source commits nothing is marked as reviewed, so every PR comes back.
+    assert sorted(result["id"] for result in remaining) == list(range(1, 21))
+    assert agent.state.listing_cursor("team/repo") is not None
@@ -0,0 +1,22 @@
+import pytest
+
+from code_reviewer.batching import ReviewBatcher, parse_batch_reviews
+
+
+def test_batcher_flushes_on_budget_and_size():
+    batcher = ReviewBatcher(max_chars=100, max_size=3)
+
+    assert batcher.add("a", 60) is None
+    # "b" does not fit next to "a", so "a" goes out alone and "b" starts a new batch.
+    assert batcher.add("b", 50) == ["a"]
+    assert batcher.add("c", 10) is None
+    assert batcher.add("d", 10) == ["b", "c", "d"]
+    assert batcher.drain() == []
+
+
+def test_parse_batch_reviews_accepts_fenced_json_and_skips_missing_ids():
+    text = '```json\n{"1": "Всё хорошо.", "2": "", "9": "чужой PR"}\n```'
+
+    assert parse_batch_reviews(text, [1, 2, 3]) == {1: "Всё хорошо."}
+    with pytest.raises(ValueError):
+        parse_batch_reviews("Не могу ответить в JSON", [1])
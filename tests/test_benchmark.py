@@ -0,0 +1,28 @@
+from benchmarks.run_benchmark import parse_args, run_benchmark
+
+
+def test_benchmark_drives_agent_against_fake_backends():
+    args = parse_args(
+        [
+            "--prs",
+            "55",
+            "--diff-lines",
+            "5",
+            "--bitbucket-latency",
+            "0",
+            "--gigachat-latency",
+            "0",
+            "--gigachat-stream",
+        ]
+    )
+
+    report = run_benchmark(args, in_process=True)
+
+    assert report["prs_reviewed"] == 55
+    assert report["prs_failed"] == 0
+    assert report["requests"]["bitbucket"]["list"] == 2
+    assert report["requests"]["bitbucket"]["comment"] == 55
+    assert report["requests"]["gigachat"]["chat"] == 55
+    assert set(report["latency_seconds"]) == {"p50", "p95", "p99", "max"}
+    assert report["latency_seconds"]["p50"] > 0
+    assert report["peak_rss_kib"] > 0
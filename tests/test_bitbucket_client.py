@@ -0,0 +1,119 @@
+import json
+
+from code_reviewer.bitbucket_client import BitbucketClient
+
+
+class StreamingResponse:
+    ok = True
+    status_code = 200
+    encoding = None
+    headers = {}
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        yield from self.chunks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.closed = True
+
+
+def test_iter_pull_request_diff_streams_lines_across_chunks(monkeypatch):
+    client = BitbucketClient("team/repo", "user", "token")
+    response = StreamingResponse([b"diff --git a/x b/x\n@@ -1 +1 @@\n-o", b"ld\n+new\n"])
+    calls = []
+
+    def fake_request(method, url, **kwargs):
+        calls.append(kwargs)
+        return response
+
+    monkeypatch.setattr(client.session, "request", fake_request)
+
+    lines = list(client.iter_pull_request_diff(3, context=1))
+
+    assert lines == ["diff --git a/x b/x", "@@ -1 +1 @@", "-old", "+new"]
+    assert calls[0]["stream"] is True
+    assert calls[0]["params"] == {"context": "1"}
+    assert response.closed
+
+
+class JsonResponse:
+    ok = True
+
+    def __init__(self, status_code, data=None, etag=None):
+        self.status_code = status_code
+        self._data = data
+        self.headers = {"ETag": etag} if etag else {}
+
+    @property
+    def content(self):
+        return json.dumps(self._data).encode() if self._data else b""
+
+    def json(self):
+        return self._data
+
+
+def test_listing_requests_partial_fields_and_reuses_pages_on_304(monkeypatch):
+    client = BitbucketClient(
+        "team/repo",
+        "user",
+        "token",
+        base_url="https://bb.test/2.0",
+        etag_cache={"/stale?page=9": {"etag": '"old"', "data": {}}},
+    )
+    base = "https://bb.test/2.0/repositories/team/repo/pullrequests"
+    page2_url = f"{base}?page=2"
+    responses = [
+        JsonResponse(200, {"values": [{"id": 1}], "next": page2_url}, etag='"p1"'),
+        JsonResponse(200, {"values": [{"id": 2}]}, etag='"p2"'),
+        JsonResponse(304),
+        JsonResponse(304),
+    ]
+    calls = []
+
+    def fake_request(method, url, **kwargs):
+        calls.append((url, kwargs["params"], kwargs["headers"]))
+        return responses.pop(0)
+
+    monkeypatch.setattr(client.session, "request", fake_request)
+
+    pages = client.iter_open_pull_request_pages()
+    assert next(pages) == [{"id": 1}]
+    assert len(calls) == 1
+    assert list(pages) == [[{"id": 2}]]
+    assert "values.source.commit.hash" in calls[0][1]["fields"]
+
+    again = client.list_open_pull_requests()
+
+    assert again == [{"id": 1}, {"id": 2}]
+    assert calls[2][2] == {"If-None-Match": '"p1"'}
+    assert calls[3] == (page2_url, None, {"If-None-Match": '"p2"'})
+    # Only pages of this listing are worth persisting; the stale entry is dropped.
+    assert len(client.requested_etags()) == 2
+    assert client.requested_etags() == {}
+
+
+def test_listing_with_the_same_cursor_reuses_etags(monkeypatch):
+    client = BitbucketClient("team/repo", "user", "token", base_url="https://bb.test/2.0")
+    responses = [JsonResponse(200, {"values": [{"id": 1}]}, etag='"p1"'), JsonResponse(304)]
+    calls = []
+
+    def fake_request(method, url, **kwargs):
+        calls.append((kwargs["params"], kwargs["headers"]))
+        return responses.pop(0)
+
+    monkeypatch.setattr(client.session, "request", fake_request)
+
+    first = client.list_open_pull_requests(updated_after="2024-01-01T10:00:00+00:00")
+    persisted = client.requested_etags()
+    second = client.list_open_pull_requests(updated_after="2024-01-01T10:00:00+00:00")
+
+    assert first == second == [{"id": 1}]
+    assert calls[0][0]["q"] == "updated_on > 2024-01-01T10:00:00+00:00"
+    assert calls[1][1] == {"If-None-Match": '"p1"'}
+    assert len(persisted) == 1
@@ -0,0 +1,29 @@
+from code_reviewer.cache import ReviewCache, normalize_diff
+
+
+def test_normalize_diff_ignores_line_numbers_index_and_whitespace():
+    first = "index 111..222 100644\n@@ -10,3 +10,4 @@ def run():\n-    x = 1\n+    x  = 2   \n+\n"
+    second = "index 333..444 100644\n@@ -42,3 +42,4 @@ def run():\n-    x = 1\n+    x = 2\n"
+
+    assert normalize_diff(first) == normalize_diff(second)
+    assert ReviewCache.key("GigaChat", "tpl", first) == ReviewCache.key("GigaChat", "tpl", second)
+    assert ReviewCache.key("GigaChat", "tpl", first) != ReviewCache.key(
+        "GigaChat-Pro", "tpl", first
+    )
+
+
+def test_cache_evicts_least_recently_used_and_persists(tmp_path):
+    path = tmp_path / "cache.json"
+    cache = ReviewCache(max_entries=2, path=str(path))
+    cache.put("a", "review a")
+    cache.put("b", "review b")
+    assert cache.get("a") == "review a"
+    cache.put("c", "review c")
+
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.save()
+    reloaded = ReviewCache(max_entries=1, path=str(path))
+    assert reloaded.get("c") == "review c"
+    assert reloaded.get("a") is None
@@ -0,0 +1,26 @@
+from code_reviewer.chunking import split_diff
+
+
+def _file_diff(name, hunks):
+    header = f"diff --git a/{name} b/{name}\n--- a/{name}\n+++ b/{name}\n"
+    body = "".join(f"@@ -{i},1 +{i},1 @@\n-old {i}\n+new {i}\n" for i in range(hunks))
+    return header + body
+
+
+def test_split_diff_keeps_small_files_together():
+    diff = _file_diff("a.py", 1) + _file_diff("b.py", 1)
+
+    assert split_diff(diff, 1000) == [diff]
+
+
+def test_split_diff_breaks_at_files_then_hunks_and_repeats_file_header():
+    big = _file_diff("big.py", 20)
+    diff = _file_diff("a.py", 1) + big
+    chunks = split_diff(diff, 200)
+
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert chunks[0].startswith("diff --git a/a.py")
+    assert all(chunk.startswith("diff --git a/big.py") for chunk in chunks[1:])
+    assert all(not chunk.endswith("-old 3\n") for chunk in chunks)
+    rebuilt = "".join(chunk.split("+++ b/big.py\n", 1)[-1] for chunk in chunks[1:])
+    assert rebuilt == big.split("+++ b/big.py\n", 1)[1]
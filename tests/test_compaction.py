@@ -0,0 +1,98 @@
+from code_reviewer.compaction import CompactionStats, compact_file
+from code_reviewer.diff_parser import parse_unified_diff, render_diff
+
+DIFF = """diff --git a/old_name.py b/new_name.py
+similarity index 100%
+rename from old_name.py
+rename to new_name.py
+diff --git a/run.sh b/run.sh
+old mode 100644
+new mode 100755
+diff --git a/logo.png b/logo.png
+index 111..222 100644
+Binary files a/logo.png and b/logo.png differ
+diff --git a/app.py b/app.py
+index 333..444 100644
+--- a/app.py
++++ b/app.py
+@@ -1,2 +1,2 @@
+-def f(a,  b):	
++def f(a, b):
+     pass
+@@ -10,1 +10,1 @@
+-x = 1
++x = 2
+diff --git a/legacy.py b/legacy.py
+deleted file mode 100644
+--- a/legacy.py
++++ /dev/null
+@@ -1,3 +0,0 @@
+-a
+-b
+-c
+"""
+
+
+def test_compaction_collapses_noise_and_keeps_real_changes():
+    stats = CompactionStats()
+    files = [compact_file(f, stats) for f in parse_unified_diff(DIFF.splitlines())]
+    text = render_diff(files)
+
+    assert "(renamed from old_name.py without content changes)" in text
+    assert "(mode changed 100644 -> 100755)" in text
+    assert "(binary file changed)" in text
+    assert "(file deleted, 3 lines removed)" in text
+    assert "def f(a" not in text
+    assert "-x = 1\n+x = 2" in text
+    assert "index 333..444" not in text
+    assert text.count("diff --git ") == 5
+    assert stats.dropped_hunks == 1
+    assert stats.collapsed_files == 4
+    assert stats.chars_after == len(text) < stats.chars_before
+
+
+def test_compaction_summarizes_long_deletions():
+    removed = "".join(f"-line {index}\n" for index in range(30))
+    diff = f"diff --git a/m.py b/m.py\n--- a/m.py\n+++ b/m.py\n@@ -1,31 +1,2 @@\n{removed}+new\n"
+    (diff_file,) = parse_unified_diff(diff.splitlines())
+
+    compact_file(diff_file, max_deleted_run=10)
+
+    assert diff_file.hunks[0].lines == [
+        "-line 0",
+        "-line 1",
+        "-line 2",
+        "... 27 more removed lines ...",
+        "+new",
+    ]
+
+
+def test_compaction_keeps_indentation_and_string_changes():
+    diff = """diff --git a/auth.py b/auth.py
+--- a/auth.py
++++ b/auth.py
+@@ -1,1 +1,1 @@
+-MSG = "access denied"
++MSG = "accessdenied"
+@@ -5,3 +5,3 @@
+ if user.is_admin:
+     grant()
+-    audit()
++audit()
+diff --git a/notes.txt b/notes.txt
+--- a/notes.txt
++++ b/notes.txt
+@@ -1,1 +1,1 @@
+-    indented   text
++  indented text
+"""
+    stats = CompactionStats()
+    files = [compact_file(f, stats) for f in parse_unified_diff(diff.splitlines())]
+    text = render_diff(files)
+
+    assert '+MSG = "accessdenied"' in text
+    assert "-    audit()\n+audit()" in text
+    # Outside whitespace-sensitive files, re-indenting is noise like in ``git diff -b``.
+    assert "(whitespace-only changes)" in text
+    assert "indented" not in text
+    assert stats.dropped_hunks == 1
@@ -0,0 +1,69 @@
+from code_reviewer.diff_parser import DiffFile, parse_unified_diff, render_diff
+
+DIFF = """diff --git a/app.py b/app.py
+index 111..222 100644
+--- a/app.py
++++ b/app.py
+@@ -1,2 +1,2 @@
+-old
++new
+ same
+diff --git a/vendor/lib/x.js b/vendor/lib/x.js
+--- a/vendor/lib/x.js
++++ b/vendor/lib/x.js
+@@ -1 +1 @@
+-a
++b
+diff --git a/Cargo.lock b/Cargo.lock
+--- a/Cargo.lock
++++ b/Cargo.lock
+@@ -1 +1 @@
+-v1
++v2
+"""
+
+
+def test_parse_yields_files_and_hunks_lazily_with_filters():
+    consumed = []
+
+    def lines():
+        for line in DIFF.splitlines():
+            consumed.append(line)
+            yield line
+
+    files = parse_unified_diff(lines(), exclude=["*.lock", "vendor/**"])
+    first = next(files)
+
+    assert isinstance(first, DiffFile)
+    assert first.path == "app.py"
+    assert [hunk.lines for hunk in first.hunks] == [["-old", "+new", " same"]]
+    # The first file is emitted as soon as the next one starts, not at the end of the stream.
+    assert len(consumed) < len(DIFF.splitlines())
+    assert list(files) == []
+    assert not hasattr(first, "__dict__")
+
+
+def test_parse_caps_file_size_and_round_trips_text():
+    files = list(parse_unified_diff(DIFF.splitlines(), include=["app.py"], max_file_chars=90))
+
+    assert [diff_file.path for diff_file in files] == ["app.py"]
+    assert files[0].omitted_lines > 0
+    assert "more lines of app.py omitted" in render_diff(files)
+    full = list(parse_unified_diff(DIFF.splitlines()))
+    assert render_diff(full) == DIFF
+
+
+def test_closing_parser_closes_source_stream():
+    closed = []
+
+    def lines():
+        try:
+            yield from DIFF.splitlines()
+        finally:
+            closed.append(True)
+
+    files = parse_unified_diff(lines())
+    next(files)
+    files.close()
+
+    assert closed == [True]
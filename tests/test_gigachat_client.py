@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from code_reviewer.gigachat_client import GigaChatClient
+
+
+class FakeSSEHandler(BaseHTTPRequestHandler):
+    """Streams a completion as server-sent events, one word every ``delay`` seconds."""
+
+    words = ["Looks ", "good, ", "but ", "add ", "tests."]
+    delay = 0.0
+    retry_after = None
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(body)
+        if self.retry_after is not None and len(self.server.requests) == 1:
+            self.send_response(503)
+            self.send_header("Retry-After", str(self.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        time.sleep(self.delay)
+        for word in self.words:
+            chunk = {"choices": [{"delta": {"content": word}}]}
+            self._event(chunk)
+            time.sleep(self.delay)
+        self._event(
+            {"choices": [{"delta": {}, "finish_reason": "stop"}], "usage": {"total_tokens": 9}}
+        )
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _event(self, data):
+        try:
+            self.wfile.write(f"data: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@pytest.fixture
+def sse_server():
+    servers = []
+
+    def start(delay, retry_after=None):
+        handler = type("Handler", (FakeSSEHandler,), {"delay": delay, "retry_after": retry_after})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _client(server, **kwargs):
+    host, port = server.server_address
+    return GigaChatClient(token="t", base_url=f"http://{host}:{port}", stream=True, **kwargs)
+
+
+def test_streaming_collects_tokens_usage_and_time_to_first_token(sse_server):
+    server = sse_server(0.0)
+
+    completion = _client(server, max_tokens=50).complete([{"role": "user", "content": "hi"}])
+
+    assert completion.content == "Looks good, but add tests."
+    assert completion.finish_reason == "stop"
+    assert not completion.truncated
+    assert completion.usage == {"total_tokens": 9}
+    assert 0 <= completion.time_to_first_token <= completion.elapsed
+    assert server.requests[0]["stream"] is True
+    assert server.requests[0]["max_tokens"] == 50
+
+
+def test_streaming_keeps_partial_answer_at_deadline(sse_server):
+    server = sse_server(0.15)
+
+    completion = _client(server, deadline=0.4).complete([{"role": "user", "content": "hi"}])
+
+    assert completion.truncated
+    assert completion.content
+    assert "tests." not in completion.content
+    assert completion.elapsed < 1.0
+
+
+def test_deadline_starts_after_retries(sse_server):
+    server = sse_server(0.05, retry_after=1)
+    client = _client(server, deadline=0.8)
+
+    completion = client.complete([{"role": "user", "content": "hi"}])
+
+    # The Retry-After wait alone exceeds the deadline, yet the answer is read in full.
+    assert len(server.requests) == 2
+    assert completion.content == "Looks good, but add tests."
+    assert not completion.truncated
+    assert completion.time_to_first_token < 1.0 <= completion.elapsed
+
+
+def test_non_streamed_answer_has_no_time_to_first_token(monkeypatch):
+    client = GigaChatClient(token="t")
+
+    class Response:
+        ok = True
+        status_code = 200
+        content = b"{}"
+        headers = {}
+
+        def json(self):
+            return {"choices": [{"message": {"content": "ok"}, "finish_reason": "stop"}]}
+
+    monkeypatch.setattr(client.session, "post", lambda *args, **kwargs: Response())
+
+    completion = client.complete([{"role": "user", "content": "hi"}], repo="team/repo")
+
+    assert completion.content == "ok"
+    assert completion.time_to_first_token is None
+    (series,) = client.metrics.summary()["counters"]["http_requests_total"]
+    assert series["labels"]["repo"] == "team/repo"
@@ -0,0 +1,57 @@
+import json
+import urllib.request
+
+from code_reviewer.metrics import Metrics
+
+
+def test_prometheus_text_has_counters_gauges_and_histograms():
+    metrics = Metrics()
+    metrics.inc("http_requests_total", backend="bitbucket", status="200")
+    metrics.inc("http_requests_total", backend="bitbucket", status="200")
+    metrics.set("review_cache_hits", 3, repo="team/repo")
+    metrics.observe("stage_seconds", 0.3, stage="diff")
+    metrics.observe("stage_seconds", 7.0, stage="diff")
+
+    text = metrics.to_prometheus()
+
+    assert "# TYPE code_reviewer_http_requests_total counter" in text
+    assert 'code_reviewer_http_requests_total{backend="bitbucket",status="200"} 2' in text
+    assert 'code_reviewer_review_cache_hits{repo="team/repo"} 3' in text
+    assert 'code_reviewer_stage_seconds_bucket{stage="diff",le="0.5"} 1' in text
+    assert 'code_reviewer_stage_seconds_bucket{stage="diff",le="+Inf"} 2' in text
+    assert 'code_reviewer_stage_seconds_count{stage="diff"} 2' in text
+
+
+def test_summary_file_and_http_endpoint(tmp_path):
+    metrics = Metrics()
+    with metrics.timer("stage_seconds", stage="review"):
+        pass
+    metrics.inc("tokens_total", 120, kind="prompt")
+
+    path = tmp_path / "summary.json"
+    metrics.write_summary(str(path), repo="team/repo")
+    summary = json.loads(path.read_text(encoding="utf-8"))
+    assert summary["repo"] == "team/repo"
+    assert summary["counters"]["tokens_total"] == [{"labels": {"kind": "prompt"}, "value": 120}]
+    assert summary["histograms"]["stage_seconds"][0]["count"] == 1
+
+    server = metrics.serve(host="127.0.0.1", port=0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert 'code_reviewer_tokens_total{kind="prompt"} 120' in body
+
+
+def test_histogram_quantiles_interpolate_within_buckets():
+    metrics = Metrics()
+    for value in (0.2, 0.2, 0.3, 0.4, 3.0):
+        metrics.observe("pr_review_seconds", value, repo="team/repo")
+
+    # The median falls into the (0.25, 0.5] bucket and is interpolated inside it.
+    assert 0.25 < metrics.quantile("pr_review_seconds", 0.5, repo="team/repo") <= 0.5
+    assert metrics.quantile("pr_review_seconds", 0.99, repo="team/repo") == 3.0
+    assert metrics.quantile("pr_review_seconds", 0.5, repo="other/repo") == 0.0
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+import requests
+
+from code_reviewer.ratelimit import AdaptiveRateLimiter
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.ok = status_code < 400
+
+    def close(self):
+        pass
+
+
+def _sender(responses):
+    sent = []
+
+    def send():
+        sent.append(True)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    return send, sent
+
+
+def test_retries_throttled_requests_honoring_retry_after_and_slows_down():
+    limiter = AdaptiveRateLimiter("Test", rate=100.0, backoff_base=0.001)
+    send, sent = _sender(
+        [FakeResponse(429, {"Retry-After": "0.01"}), FakeResponse(503), FakeResponse(200)]
+    )
+
+    response = limiter.send(send)
+
+    assert response.status_code == 200
+    assert len(sent) == 3
+    assert limiter.retries == 2
+    assert limiter.throttled_seconds >= 0.01
+    assert limiter.rate < 100.0
+
+
+def test_rate_ramps_back_up_after_successes():
+    limiter = AdaptiveRateLimiter("Test", rate=100.0)
+    limiter.rate = 10.0
+
+    for _ in range(5):
+        limiter.send(lambda: FakeResponse(200))
+
+    assert 10.0 < limiter.rate <= 100.0
+
+
+def test_non_idempotent_requests_are_not_retried_on_server_errors():
+    limiter = AdaptiveRateLimiter("Test", rate=100.0, backoff_base=0.001)
+    send, sent = _sender([FakeResponse(500), FakeResponse(200)])
+
+    assert limiter.send(send, idempotent=False).status_code == 500
+    assert len(sent) == 1
+
+    send, sent = _sender([requests.ConnectionError("reset"), FakeResponse(200)])
+    with pytest.raises(requests.ConnectionError):
+        limiter.send(send, idempotent=False)
+
+
+def test_gives_up_after_max_retries():
+    limiter = AdaptiveRateLimiter("Test", rate=100.0, max_retries=2, backoff_base=0.001)
+    send, sent = _sender([FakeResponse(502), FakeResponse(502), FakeResponse(502)])
+
+    assert limiter.send(send).status_code == 502
+    assert len(sent) == 3
+
+
+def test_a_pause_shared_by_many_workers_is_counted_once():
+    limiter = AdaptiveRateLimiter("Test", rate=100.0, backoff_base=0.001)
+    send, _ = _sender([FakeResponse(429, {"Retry-After": "0.2"}), FakeResponse(200)])
+    workers = [threading.Thread(target=limiter.acquire) for _ in range(8)]
+
+    limiter.send(send)
+    limiter._slow_down(0.2)  # pylint: disable=protected-access
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # The retry after Retry-After and then a second pause: 0.2 s each, not per waiting worker.
+    assert 0.4 <= limiter.throttled_seconds < 0.6
+    (series,) = limiter.metrics.summary()["counters"]["throttled_seconds_total"]
+    assert series["value"] == pytest.approx(limiter.throttled_seconds)
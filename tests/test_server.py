@@ -0,0 +1,91 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+import requests
+
+from code_reviewer.server import ReviewQueue, WebhookServer
+
+
+class FakeCache:
+    def save(self):
+        pass
+
+
+class RecordingAgent:
+    repo_slug = "team/repo"
+
+    def __init__(self):
+        self.cache = FakeCache()
+        self.reviewed = []
+        self.event = threading.Event()
+
+    def review_pull_request(self, pr):
+        self.reviewed.append((pr["id"], pr["source"]["commit"]["hash"]))
+        self.event.set()
+        return {"id": pr["id"]}
+
+
+def _post_webhook(server, event, pr_id, commit, repo="team/repo", secret=None):
+    """Act as Bitbucket: deliver a pull request webhook to the local endpoint."""
+    payload = {
+        "repository": {"full_name": repo},
+        "pullrequest": {"id": pr_id, "state": "OPEN", "source": {"commit": {"hash": commit}}},
+    }
+    body = json.dumps(payload).encode()
+    headers = {"X-Event-Key": event, "Content-Type": "application/json"}
+    if secret:
+        digest = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        headers["X-Hub-Signature"] = f"sha256={digest}"
+    host, port = server.address
+    return requests.post(f"http://{host}:{port}/", data=body, headers=headers, timeout=5)
+
+
+def test_webhook_bursts_are_coalesced_into_one_review_of_latest_head():
+    agent = RecordingAgent()
+    server = WebhookServer(agent, port=0, workers=1, coalesce_seconds=0.2, secret="s3cret")
+    server.start()
+    try:
+        for commit in ("aaa", "bbb", "ccc"):
+            response = _post_webhook(server, "pullrequest:updated", 5, commit, secret="s3cret")
+            assert response.status_code == 202
+        assert _post_webhook(server, "repo:push", 6, "ddd", secret="s3cret").json() == {
+            "status": "ignored event repo:push"
+        }
+        assert (
+            _post_webhook(
+                server, "pullrequest:created", 7, "eee", repo="team/other", secret="s3cret"
+            )
+            .json()["status"]
+            .startswith("ignored repository")
+        )
+        assert _post_webhook(server, "pullrequest:created", 8, "fff").status_code == 401
+
+        assert agent.event.wait(5)
+        time.sleep(0.3)
+    finally:
+        server.stop()
+
+    assert agent.reviewed == [(5, "ccc")]
+
+
+def test_queue_is_bounded_and_never_runs_one_pr_twice_at_once():
+    queue = ReviewQueue(maxsize=1, coalesce_seconds=0)
+    assert queue.put({"id": 1, "rev": 1})
+    assert not queue.put({"id": 2})
+
+    first = queue.get()
+    assert queue.put({"id": 1, "rev": 2})
+    results = []
+    worker = threading.Thread(target=lambda: results.append(queue.get()))
+    worker.start()
+    time.sleep(0.05)
+    assert results == []
+
+    queue.done(first["id"])
+    worker.join(1)
+    assert results == [{"id": 1, "rev": 2}]
+    queue.close()
+    assert queue.get() is None
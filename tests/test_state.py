@@ -0,0 +1,13 @@
+from code_reviewer.state import ReviewState
+
+
+def test_state_persists_last_reviewed_commit(tmp_path):
+    path = tmp_path / "state" / "reviews.json"
+    state = ReviewState(str(path))
+    assert state.last_commit("team/repo", 7) is None
+
+    state.record("team/repo", 7, "abc123")
+
+    reloaded = ReviewState(str(path))
+    assert reloaded.last_commit("team/repo", 7) == "abc123"
+    assert reloaded.last_commit("team/other", 7) is None
@@ -0,0 +1,44 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from code_reviewer.triage import DiffStat, PriorityRule, priority
+
+NOW = datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+
+def test_diffstat_counts_only_paths_passing_the_filters():
+    entries = [
+        {"new": {"path": "app.py"}, "lines_added": 3, "lines_removed": 1},
+        {"new": {"path": "poetry.lock"}, "lines_added": 900, "lines_removed": 800},
+        {"old": {"path": "gone.py"}, "new": None, "lines_added": 0, "lines_removed": 7},
+    ]
+
+    stat = DiffStat.from_entries(entries, exclude=["*.lock"])
+
+    assert stat.paths == ["app.py", "gone.py"]
+    assert stat.changed_lines == 11
+
+
+def test_priority_prefers_small_old_and_rule_matching_prs():
+    small = DiffStat(["a.py"], 5, 5)
+    big = DiffStat(["b.py"], 400, 100)
+    hotfix = {"source": {"branch": {"name": "hotfix/login"}}, "created_on": "2024-01-02T00:00:00Z"}
+    feature = {"source": {"branch": {"name": "feature/x"}}, "created_on": "2024-01-02T00:00:00Z"}
+    old = {"created_on": "2024-01-01T00:00:00+00:00"}
+    rules = [PriorityRule.parse("branch:hotfix/*")]
+
+    assert priority(feature, small, rules, NOW) < priority(feature, big, rules, NOW)
+    assert priority(hotfix, big, rules, NOW) < priority(feature, small, rules, NOW)
+    # A day of waiting is worth 240 lines.
+    assert priority(old, big, now=NOW) == 500 - 240
+
+
+def test_priority_rule_parsing():
+    rule = PriorityRule.parse("path:db/migrations/*=250")
+
+    assert (rule.kind, rule.pattern, rule.weight) == ("path", "db/migrations/*", 250.0)
+    assert rule.matches({}, DiffStat(["db/migrations/0001.sql"], 1, 0))
+    for value in ("hotfix/*", "label:x", "path:x=heavy"):
+        with pytest.raises(ValueError):
+            PriorityRule.parse(value)
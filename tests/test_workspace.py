@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.fake_services import FakeBehavior, FakeBitbucket, FakeGigaChat
+from code_reviewer.lease import Leases
+from code_reviewer.workspace import (
+    in_shard,
+    parse_shard,
+    review_repository,
+    sweep_workspace,
+)
+
+
+def test_shards_split_repositories_deterministically():
+    repos = [f"team/repo-{index}" for index in range(50)]
+
+    shards = [[repo for repo in repos if in_shard(repo, (i, 3))] for i in (1, 2, 3)]
+
+    assert sorted(sum(shards, [])) == sorted(repos)
+    assert all(shards)
+    assert parse_shard("2/3") == (2, 3)
+    for value in ("0/3", "4/3", "1-3"):
+        with pytest.raises(ValueError):
+            parse_shard(value)
+
+
+def test_leases_are_exclusive_until_released_or_expired(tmp_path):
+    first = Leases(str(tmp_path), ttl=60)
+    second = Leases(str(tmp_path), ttl=60)
+    second.owner = "other-host:1"
+
+    assert first.acquire("team/repo#1")
+    assert not second.acquire("team/repo#1")
+    second.release("team/repo#1")
+    assert not second.acquire("team/repo#1")
+    first.release("team/repo#1")
+    assert second.acquire("team/repo#1")
+
+    # A worker that crashed holding a lease does not block the PR forever.
+    stale = time.time() - 120
+    os.utime(second._path("team/repo#1"), (stale, stale))  # pylint: disable=protected-access
+    assert first.acquire("team/repo#1")
+
+
+def test_only_one_worker_breaks_an_expired_lease(tmp_path):
+    Leases(str(tmp_path)).acquire("team/repo#1")
+    stale = time.time() - 7200
+    path = Leases(str(tmp_path))._path("team/repo#1")  # pylint: disable=protected-access
+    os.utime(path, (stale, stale))
+    workers = [Leases(str(tmp_path)) for _ in range(8)]
+    for index, worker in enumerate(workers):
+        worker.owner = f"host:{index}"
+    barrier = threading.Barrier(len(workers))
+
+    def acquire(worker):
+        barrier.wait()
+        return worker.acquire("team/repo#1")
+
+    with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+        won = list(pool.map(acquire, workers))
+
+    assert won.count(True) == 1
+    assert Leases._holder(path) == workers[won.index(True)].owner
+    assert sorted(os.listdir(tmp_path)) == [".lock", os.path.basename(path)]
+
+
+def test_three_workers_never_share_a_broken_lease(tmp_path):
+    path = Leases(str(tmp_path))._path("team/repo#1")  # pylint: disable=protected-access
+    workers = [Leases(str(tmp_path)) for _ in range(3)]
+    for index, worker in enumerate(workers):
+        worker.owner = f"host:{index}"
+
+    for _ in range(20):
+        Leases(str(tmp_path)).acquire("team/repo#1")
+        stale = time.time() - 7200
+        os.utime(path, (stale, stale))
+        barrier = threading.Barrier(len(workers))
+
+        def acquire(worker):
+            barrier.wait()
+            return worker.acquire("team/repo#1")
+
+        with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+            won = list(pool.map(acquire, workers))
+
+        # Whoever is late sees the winner's fresh lease and must not break it again.
+        assert won.count(True) == 1
+        winner = workers[won.index(True)]
+        assert not any(worker.acquire("team/repo#1") for worker in workers)
+        assert Leases._holder(path) == winner.owner
+        winner.release("team/repo#1")
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_sweep_workspace_reviews_every_repository_of_the_shard(tmp_path, processes):
+    repos = ["team/api", "team/web", "team/tools"]
+    bitbucket = FakeBitbucket(FakeBehavior(), pr_count=2, diff_lines=3, repositories=repos).start()
+    gigachat = FakeGigaChat(FakeBehavior()).start()
+    options = {
+        "bitbucket_username": "user",
+        "bitbucket_token": "token",
+        "gigachat_token": "giga",
+        "bitbucket_api_url": bitbucket.api_url,
+        "gigachat_url": gigachat.api_url,
+        "state_path": str(tmp_path / "state"),
+        "lease_dir": str(tmp_path / "leases"),
+    }
+    try:
+        report = sweep_workspace("team", options, processes=processes)
+    finally:
+        bitbucket.stop()
+        gigachat.stop()
+
+    assert [repo["repo"] for repo in report["repositories"]] == sorted(repos)
+    assert report["totals"] == {"repositories": 3, "failed_repositories": 0, "reviewed": 6}
+    assert sorted(os.listdir(tmp_path / "state")) == [
+        "team__api.json",
+        "team__tools.json",
+        "team__web.json",
+    ]
+    assert [name for name in os.listdir(tmp_path / "leases") if name.endswith(".lease")] == []
+
+
+def test_repositories_of_one_worker_share_clients(tmp_path):
+    repos = ["team/api", "team/web"]
+    bitbucket = FakeBitbucket(FakeBehavior(), pr_count=2, diff_lines=3, repositories=repos).start()
+    gigachat = FakeGigaChat(FakeBehavior()).start()
+    options = {
+        "bitbucket_username": "user",
+        "bitbucket_token": "token",
+        "gigachat_token": "giga",
+        "bitbucket_api_url": bitbucket.api_url,
+        "gigachat_url": gigachat.api_url,
+    }
+    clients = {}
+    try:
+        reports = [review_repository(repo, options, clients) for repo in repos]
+    finally:
+        bitbucket.stop()
+        gigachat.stop()
+
+    assert set(clients) == {"metrics", "bitbucket_session", "bitbucket_rate_limiter", "gigachat"}
+    # Outcomes come from the shared registry, but each report counts only its own PRs.
+    assert [report["outcomes"] for report in reports] == [{"reviewed": 2}, {"reviewed": 2}]
+    requests_by_repo = {
+        series["labels"]["repo"]
+        for series in clients["metrics"].summary()["counters"]["http_requests_total"]
+        if series["labels"]["backend"] == "gigachat"
+    }
+    assert requests_by_repo == set(repos)